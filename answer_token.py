@@ -0,0 +1,73 @@
+"""
+Signatures of what the server hands to the browser: the status of the session,
+and the per-round answer tokens used when the answers are checked in the browser.
+
+The status of each session is stored in the browser (see `ui.Status.to_dict`) and
+sent back with each callback. It is signed (HMAC): a status that was not built by
+the server is rejected, so the game, its order and its score cannot be edited.
+The browser can still send back an older status of its own session: the server
+keeps no state, it cannot tell that the status was replaced since.
+
+With WORLDLE_CLIENTSIDE_CHECK=1, the browser receives with each question a small
+token holding the round number, the expected answer and a signature of both,
+bound to the game (session id & seed, which are part of the signed status).
+The answer is checked and the score updated by a clientside callback, without
+waiting for the server. The guess is then sent with the token to the server,
+which only records results of the rounds of the current game it issued.
+
+The same key seeds the order of the questions (see `ui.shuffled_ids`): without it,
+the order cannot be computed from the seed stored in the browser.
+
+The key of the signatures is read from WORLDLE_SECRET_KEY. Without it, a random key
+is drawn when the module is imported: all the processes serving the app must then
+be forked from the same one (e.g: gunicorn with preload_app).
+"""
+import os
+import hmac
+import hashlib
+
+from typing import Dict, Any, Optional, Tuple
+
+CLIENTSIDE_CHECK: bool = os.environ.get("WORLDLE_CLIENTSIDE_CHECK", "0") == "1"
+SECRET_KEY: bytes = os.environ.get("WORLDLE_SECRET_KEY", "").encode("utf-8") or os.urandom(32)
+
+
+def sign(sid: str, seed: int, round_idx: int, answer: int) -> str:
+    """Signature of the answer of a round of a game"""
+    message: bytes = f"{sid}|{seed}|{round_idx}|{answer}".encode("utf-8")
+    return hmac.new(SECRET_KEY, message, hashlib.sha256).hexdigest()[:16]
+
+
+def sign_status(values: Tuple[Any, ...]) -> str:
+    """Signature of the values of the fields of a status, in a fixed order"""
+    message: bytes = b"status|" + repr(values).encode("utf-8")
+    return hmac.digest(SECRET_KEY, message, "sha256").hex()[:32]
+
+
+def verify_status(values: Tuple[Any, ...], sig: Any) -> bool:
+    """Whether the status was built by the server, as it is"""
+    return isinstance(sig, str) and hmac.compare_digest(sign_status(values), sig)
+
+
+def shuffle_seed(seed: int) -> bytes:
+    """Seed of the shuffle of the questions of a game"""
+    return hmac.new(SECRET_KEY, f"shuffle|{seed}".encode("utf-8"), hashlib.sha256).digest()
+
+
+def make_token(sid: str, seed: int, round_idx: int, answer: int) -> Dict[str, Any]:
+    return {
+        "round": round_idx,
+        "answer": answer,
+        "sig": sign(sid, seed, round_idx, answer),
+    }
+
+
+def verify_token(token: Optional[Dict[str, Any]], sid: str, seed: int) -> bool:
+    """Whether the token was issued by the server for this game"""
+    if not token or not isinstance(token.get("sig"), str):
+        return False
+    try:
+        expected: str = sign(sid, seed, int(token["round"]), int(token["answer"]))
+    except (KeyError, TypeError, ValueError):
+        return False
+    return hmac.compare_digest(expected, token["sig"])
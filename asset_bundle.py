@@ -0,0 +1,128 @@
+"""
+Packs all the images of the game (outlines, flags and their optimized variants)
+in a single bundle file.
+
+The bundle is opened with mmap: the images are memoryview slices of the file,
+so every process serving the app shares the same pages of the OS page cache
+instead of holding its own copy of the images.
+
+Format (little endian):
+    - header: magic (4 bytes), version (u32), number of entries (u32), size of the index (u32)
+    - index: for each entry, the key length (u16), the key (utf-8),
+      the offset of the data in the blob region (u64), its length (u64)
+      and the digest of the data (16 ascii chars)
+    - blob region: the data of all entries, one after the other
+"""
+import os
+import mmap
+import struct
+
+from typing import List, Dict, Tuple, Optional, Iterator
+
+from image_cache import ImageCache
+from asset_optimizer import load_manifest, MANIFEST_KEY
+
+BUNDLE_PATH: str = os.path.join("files", "assets.bundle")
+BUNDLE_MAGIC: bytes = b"WLDB"
+BUNDLE_VERSION: int = 1
+HEADER: struct.Struct = struct.Struct("<4sIII")
+KEY_LENGTH: struct.Struct = struct.Struct("<H")
+ENTRY: struct.Struct = struct.Struct("<QQ16s")
+
+
+class AssetBundle:
+    """Read-only access to a bundle file"""
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        with open(path, "rb") as f:
+            self._mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view: memoryview = memoryview(self._mmap)
+        magic, version, n_entries, index_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+            raise ValueError(f"{path} is not a bundle of version {BUNDLE_VERSION}")
+        blob_start: int = HEADER.size + index_size
+        # key => (start, end, digest)
+        self.index: Dict[str, Tuple[int, int, str]] = {}
+        pos: int = HEADER.size
+        for _ in range(n_entries):
+            (key_length,) = KEY_LENGTH.unpack_from(self._mmap, pos)
+            pos += KEY_LENGTH.size
+            key: str = bytes(self._view[pos:pos + key_length]).decode("utf-8")
+            pos += key_length
+            offset, length, digest = ENTRY.unpack_from(self._mmap, pos)
+            pos += ENTRY.size
+            start: int = blob_start + offset
+            self.index[key] = (start, start + length, digest.decode("ascii"))
+
+    @staticmethod
+    def open_if_exists(path: str = BUNDLE_PATH) -> Optional["AssetBundle"]:
+        if not os.path.exists(path):
+            return None
+        return AssetBundle(path)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get(self, key: str) -> memoryview:
+        """Zero-copy view on the data of an entry"""
+        start, end, _ = self.index[key]
+        return self._view[start:end]
+
+    def digest(self, key: str) -> str:
+        return self.index[key][2]
+
+    @staticmethod
+    def build(source_folder: str, keys: List[str], path: str = BUNDLE_PATH) -> None:
+        """Writes the bundle of the given files (paths relative to source_folder)"""
+        index: List[bytes] = []
+        offset: int = 0
+        for key in keys:
+            length: int = os.path.getsize(os.path.join(source_folder, key))
+            with open(os.path.join(source_folder, key), "rb") as f:
+                digest: str = ImageCache.compute_digest(f.read())
+            key_bytes: bytes = key.encode("utf-8")
+            index.append(
+                KEY_LENGTH.pack(len(key_bytes)) + key_bytes
+                + ENTRY.pack(offset, length, digest.encode("ascii"))
+            )
+            offset += length
+        index_bytes: bytes = b"".join(index)
+        # We write to a temporary file so a running server never maps a partial bundle
+        tmp_path: str = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(keys), len(index_bytes)))
+            f.write(index_bytes)
+            for key in keys:
+                with open(os.path.join(source_folder, key), "rb") as f_in:
+                    f.write(f_in.read())
+        os.replace(tmp_path, path)
+        print(f"Bundle {path}: {len(keys)} files, {offset / 2 ** 20:.1f} MB")
+
+
+def list_assets(source_folder: str = "files") -> List[str]:
+    """
+    Lists the images to bundle: the original outlines & flags, and the
+    optimized variants (with their manifest) if they were generated.
+    """
+    keys: List[str] = [
+        f"{sub_folder}/{file_name}"
+        for sub_folder in ["outlines", "flags"]
+        for file_name in sorted(os.listdir(os.path.join(source_folder, sub_folder)))
+        if file_name.endswith(".png")
+    ]
+    manifest: Optional[Dict] = load_manifest(os.path.join(source_folder, MANIFEST_KEY))
+    if manifest is not None:
+        keys += [v["key"] for entry in manifest["images"].values() for v in entry["variants"]]
+        keys.append(MANIFEST_KEY)
+    return keys
+
+
+if __name__ == "__main__":
+    AssetBundle.build(source_folder="files", keys=list_assets("files"), path=BUNDLE_PATH)
@@ -0,0 +1,143 @@
+"""
+Post-processing of the outline & flag images.
+
+The outlines are drawn at 300 dpi (more than 2000 pixels wide) while they are
+displayed on a small part of the screen. This script produces, for each image,
+several smaller variants in lossless WebP, and writes a manifest describing them
+so the UI can let the browser choose the right one (srcset).
+"""
+import os
+import json
+import hashlib
+
+from PIL import Image
+import tqdm
+from typing import List, Dict, Any, Optional, Union
+
+# Widths (in pixels) of the variants we produce
+VARIANT_WIDTHS: List[int] = [256, 512, 1024]
+MANIFEST_VERSION: int = 1
+# Path of the manifest, relative to the source folder
+MANIFEST_KEY: str = "optimized/manifest.json"
+
+
+class AssetOptimizer:
+
+    def __init__(
+            self,
+            source_folder: str = "files",
+            output_folder: str = "optimized",
+            widths: List[int] = VARIANT_WIDTHS,
+        ) -> None:
+        """
+        source_folder: folder containing the "outlines" & "flags" folders
+        output_folder: folder of the variants, relative to source_folder
+        """
+        self.source_folder: str = source_folder
+        self.output_folder: str = output_folder
+        self.widths: List[int] = sorted(widths)
+        self.manifest_path: str = os.path.join(source_folder, MANIFEST_KEY)
+
+    def optimize_all(self, sub_folders: List[str] = ["outlines", "flags"]) -> Dict[str, Any]:
+        """
+        Builds the variants of every image of the sub folders and saves the manifest.
+        Images whose content did not change since the last run are skipped.
+        """
+        previous: Dict[str, Any] = load_manifest(self.manifest_path) or {}
+        previous_images: Dict[str, Any] = previous.get("images", {})
+        if previous.get("widths") != self.widths:  # Everything has to be rebuilt
+            previous_images = {}
+
+        images: Dict[str, Any] = {}
+        keys: List[str] = [
+            f"{sub_folder}/{file_name}"
+            for sub_folder in sub_folders
+            for file_name in sorted(os.listdir(os.path.join(self.source_folder, sub_folder)))
+            if file_name.endswith(".png")
+        ]
+        n_built: int = 0
+        for key in tqdm.tqdm(keys, desc="Optimizing images"):
+            with open(os.path.join(self.source_folder, key), "rb") as f:
+                source_digest: str = hashlib.sha256(f.read()).hexdigest()[:16]
+            entry: Optional[Dict[str, Any]] = previous_images.get(key)
+            if entry is None or entry["source_digest"] != source_digest or not all(
+                    os.path.exists(os.path.join(self.source_folder, v["key"]))
+                    for v in entry["variants"]):
+                entry = {
+                    "source_digest": source_digest,
+                    "variants": self.optimize_image(key),
+                }
+                n_built += 1
+            images[key] = entry
+
+        manifest: Dict[str, Any] = {
+            "version": MANIFEST_VERSION,
+            "widths": self.widths,
+            "images": images,
+        }
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1, ensure_ascii=False)
+        print(f"{n_built} images optimized, {len(images) - n_built} unchanged")
+        return manifest
+
+    def optimize_image(self, key: str) -> List[Dict[str, Any]]:
+        """Writes the variants of 1 image, returns their description"""
+        image: Image.Image = Image.open(os.path.join(self.source_folder, key))
+        # Palette images (flags) must be converted before resizing
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode == "RGBA" else "RGB")
+        width: int; height: int
+        width, height = image.size
+        # We never upscale: the largest variant is at most the original size
+        widths: List[int] = [w for w in self.widths if w < width]
+        if not widths or widths[-1] < min(width, self.widths[-1]):
+            widths.append(min(width, self.widths[-1]))
+
+        out_folder: str = os.path.join(self.source_folder, self.output_folder, os.path.dirname(key))
+        os.makedirs(out_folder, exist_ok=True)
+        base_name: str = os.path.splitext(os.path.basename(key))[0]
+        variants: List[Dict[str, Any]] = []
+        for w in widths:
+            h: int = max(1, round(height * w / width))
+            resized: Image.Image = image if w == width else image.resize((w, h), Image.LANCZOS)
+            variant_key: str = f"{self.output_folder}/{os.path.dirname(key)}/{base_name}_{w}.webp"
+            variant_path: str = os.path.join(self.source_folder, variant_key)
+            resized.save(variant_path, format="WEBP", lossless=True, quality=100, method=4)
+            with open(variant_path, "rb") as f:
+                data: bytes = f.read()
+            variants.append({
+                "key": variant_key,
+                "width": w,
+                "height": h,
+                "bytes": len(data),
+                "digest": hashlib.sha256(data).hexdigest()[:16],
+            })
+        # Resizing images with few colors (flags) can produce bigger files because of
+        # the anti-aliasing: we only keep a variant if it is lighter than the larger ones.
+        kept: List[Dict[str, Any]] = []
+        for variant in reversed(variants):
+            if kept and variant["bytes"] >= kept[-1]["bytes"]:
+                os.remove(os.path.join(self.source_folder, variant["key"]))
+            else:
+                kept.append(variant)
+        return kept[::-1]
+
+
+def load_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Loads the manifest of the variants, None if it does not exist or is outdated"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return parse_manifest(f.read())
+
+
+def parse_manifest(data: Union[bytes, memoryview]) -> Optional[Dict[str, Any]]:
+    """Parses the content of the manifest, None if it is outdated"""
+    manifest: Dict[str, Any] = json.loads(bytes(data).decode("utf-8"))
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+if __name__ == "__main__":
+    ao = AssetOptimizer(source_folder="files")
+    ao.optimize_all()
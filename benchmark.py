@@ -0,0 +1,236 @@
+"""
+Micro-benchmarks of the startup, of the work done in the callbacks and of the
+merge of the datasets, compared to a stored baseline.
+
+    python3 benchmark.py                     # Runs & compares to benchmark_baseline.json
+    python3 benchmark.py --json report.json  # Also writes the report
+    python3 benchmark.py --update-baseline   # Stores the results as the new baseline
+    python3 benchmark.py --filter callback.  # Only the benchmarks whose name contains it
+
+A benchmark regresses when its time goes above its baseline time multiplied by
+its max ratio (stored in the baseline, DEFAULT_MAX_RATIO by default). The exit
+code is then 1. Times depend on the machine: the baseline must be updated when
+the benchmarks are run on another one.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+import pandas as pd
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+from data import Ngram, DataMerger, SnapshotBuilder
+from snapshot import load_or_build_snapshot, CSV_PATH, SNAPSHOT_FOLDER
+from ui import UI, GameData, CountryTable, Status, shuffled_ids
+
+BASELINE_PATH: str = "benchmark_baseline.json"
+# A benchmark regresses when it is that many times slower than its baseline
+DEFAULT_MAX_RATIO: float = 1.5
+# Each measure loops over the benchmark for at least this long (s)
+MIN_MEASURE_TIME: float = 0.2
+
+
+class Benchmarks:
+    """
+    The benchmarks, by name. Each setup function prepares its inputs and
+    returns the function to time (without arguments).
+    """
+
+    def __init__(self) -> None:
+        self.data: GameData = GameData()
+        self.table: CountryTable = self.data.table
+        self.ui: UI = UI(self.data)
+        self.benchmarks: Dict[str, Callable[[], Callable[[], Any]]] = {
+            # Startup
+            "startup.load_dataframe": self.load_dataframe,
+            "startup.tag_data_with_info": self.tag_data_with_info,
+            "startup.load_snapshot": self.load_snapshot,
+            "startup.country_table": self.country_table,
+            # Callbacks
+            "callback.compute_mask_eligible": self.compute_mask_eligible,
+            "callback.compute_mask_eligible_uncached": self.compute_mask_eligible_uncached,
+            "callback.sample_new_question": self.sample_new_question,
+            "callback.shuffle_questions_uncached": self.shuffle_questions_uncached,
+            "callback.update_dropdown_options": self.update_dropdown_options,
+            "callback.update_dropdown_options_uncached": self.update_dropdown_options_uncached,
+            "callback.status_round_trip": self.status_round_trip,
+            # Merge of the datasets (data.py)
+            "merge.build_similarity_map": self.build_similarity_map,
+            "merge.solve_similarity_map": self.solve_similarity_map,
+        }
+
+    def load_dataframe(self) -> Callable[[], Any]:
+        return lambda: SnapshotBuilder.load_dataframe(CSV_PATH)
+
+    def tag_data_with_info(self) -> Callable[[], Any]:
+        df: pd.DataFrame = SnapshotBuilder.load_dataframe(CSV_PATH)
+        # The columns are added in place: each run works on a copy
+        return lambda: SnapshotBuilder.tag_data_with_info(df.copy())
+
+    def load_snapshot(self) -> Callable[[], Any]:
+        return lambda: load_or_build_snapshot(CSV_PATH, SNAPSHOT_FOLDER)
+
+    def country_table(self) -> Callable[[], Any]:
+        snapshot = load_or_build_snapshot(CSV_PATH, SNAPSHOT_FOLDER)
+        return lambda: CountryTable(snapshot)
+
+    def random_settings(self, rng: random.Random) -> Tuple[str, str, frozenset, frozenset]:
+        return (
+            rng.choice(self.ui.s.quizz_input_options),
+            rng.choice(self.ui.s.quizz_target_options),
+            frozenset(rng.sample(self.data.categories, rng.randint(0, len(self.data.categories)))),
+            frozenset(rng.sample(self.data.continents, rng.randint(1, len(self.data.continents)))),
+        )
+
+    def compute_mask_eligible(self) -> Callable[[], Any]:
+        """Default settings, as computed at each reset (cached after the first one)"""
+        return self.ui._compute_mask_eligible
+
+    def compute_mask_eligible_uncached(self) -> Callable[[], Any]:
+        """Random settings, bypassing the cache"""
+        rng: random.Random = random.Random(0)
+        settings: List[Tuple] = [self.random_settings(rng) for _ in range(64)]
+        eligible: Callable = CountryTable.eligible.__wrapped__
+
+        def run() -> None:
+            for s in settings:
+                eligible(self.table, *s)
+        return run
+
+    def sample_new_question(self) -> Callable[[], Any]:
+        ui: UI = self.ui
+
+        def run() -> None:
+            if ui.s._n_questions >= ui.s._n_total:
+                ui.s._n_questions = 0
+            ui.sample_new_question()
+        return run
+
+    def shuffle_questions_uncached(self) -> Callable[[], Any]:
+        """Order of the questions of a new game"""
+        shuffle: Callable = shuffled_ids.__wrapped__
+        return lambda: shuffle(self.ui.s.seed, self.ui.s.eligible)
+
+    def update_dropdown_options(self) -> Callable[[], Any]:
+        return self.ui.update_dropdown_options
+
+    def update_dropdown_options_uncached(self) -> Callable[[], Any]:
+        dropdown_options: Callable = CountryTable.dropdown_options.__wrapped__
+        return lambda: dropdown_options(self.table, self.ui.s.quizz_target, self.ui.s.eligible)
+
+    def status_round_trip(self) -> Callable[[], Any]:
+        """What each callback does with the status of the session"""
+        d: Dict[str, Any] = self.ui.s.to_dict()
+        return lambda: Status.from_dict(d, self.table).to_dict()
+
+    @staticmethod
+    def file_names() -> Tuple[List[str], List[str]]:
+        """The names of the flag & outline files, as listed by DataMerger"""
+        flags: List[str] = sorted(pd.read_csv("files/df_flags.csv", sep=";")["flag_file_name"])
+        outlines: List[str] = sorted(pd.read_csv("files/df_outlines.csv", sep=";")["outline_file_name"])
+        return flags, outlines
+
+    def build_similarity_map(self) -> Callable[[], Any]:
+        flags, outlines = __class__.file_names()
+        return lambda: Ngram.build_similarity_map(flags, outlines)
+
+    def solve_similarity_map(self) -> Callable[[], Any]:
+        df: pd.DataFrame = Ngram.build_similarity_map(*__class__.file_names())
+        return lambda: DataMerger.solve_similarity_map(df, 0.48)
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """
+    Time of 1 call (s): each measure loops at least MIN_MEASURE_TIME. The best
+    measure is kept, the others being slowed down by the rest of the machine.
+    """
+    func()  # Warm up
+    t: float = time.perf_counter()
+    func()
+    once: float = time.perf_counter() - t
+    number: int = max(1, int(MIN_MEASURE_TIME / max(once, 1e-9)))
+    times: List[float] = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - t) / number)
+    return {
+        "seconds": min(times),
+        "median_seconds": statistics.median(times),
+        "loops": number,
+        "repeat": repeat,
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Adds the ratio to the baseline & the status of each benchmark"""
+    report: Dict[str, Dict[str, Any]] = {}
+    for name, result in results.items():
+        base: Optional[Dict[str, float]] = baseline.get(name)
+        entry: Dict[str, Any] = dict(result)
+        if base is None:
+            entry["status"] = "new"
+        else:
+            max_ratio: float = base.get("max_ratio", DEFAULT_MAX_RATIO)
+            entry["baseline_seconds"] = base["seconds"]
+            entry["max_ratio"] = max_ratio
+            entry["ratio"] = result["seconds"] / base["seconds"]
+            entry["status"] = "regression" if entry["ratio"] > max_ratio else "ok"
+        report[name] = entry
+    return report
+
+
+def format_time(seconds: float) -> str:
+    for unit, factor in [("s", 1), ("ms", 1e-3), ("us", 1e-6)]:
+        if seconds >= factor:
+            return f"{seconds / factor:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--filter", default="", help="Only runs the benchmarks containing this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Writes the report to this file")
+    args = parser.parse_args()
+
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline: Dict[str, Any] = json.load(f)["benchmarks"]
+    except FileNotFoundError:
+        baseline = {}
+
+    benchmarks: Benchmarks = Benchmarks()
+    results: Dict[str, Dict[str, float]] = {}
+    for name, setup in benchmarks.benchmarks.items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(setup(), args.repeat)
+    report: Dict[str, Dict[str, Any]] = compare(results, baseline)
+
+    print(f"{'benchmark':<45} {'time':>10} {'baseline':>10} {'ratio':>6}  status")
+    for name, entry in report.items():
+        base: str = format_time(entry["baseline_seconds"]) if "baseline_seconds" in entry else "-"
+        ratio: str = f"{entry['ratio']:.2f}" if "ratio" in entry else "-"
+        print(f"{name:<45} {format_time(entry['seconds']):>10} {base:>10} {ratio:>6}  {entry['status']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "benchmarks": report}, f, indent=1)
+    if args.update_baseline:
+        for name, result in results.items():
+            baseline[name] = {
+                "seconds": result["seconds"],
+                "max_ratio": baseline.get(name, {}).get("max_ratio", DEFAULT_MAX_RATIO),
+            }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"benchmarks": baseline}, f, indent=1, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+    elif any(entry["status"] == "regression" for entry in report.values()):
+        sys.exit(1)
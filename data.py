@@ -5,7 +5,12 @@ import math
 import os
 
 from typing import Dict, Any, Set, Iterable, List, Tuple
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+
+from snapshot import save_snapshot, source_digest, CATEGORIES
 
 
 class Ngram:
@@ -53,6 +58,45 @@ class Ngram:
         if n1 * n2 == 0: return 0.0
         return out / (n1 * n2)
     
+    @staticmethod
+    def tf_matrix(ngrams: List["Ngram"], vocabulary: Dict[str, int]) -> sparse.csr_matrix:
+        """
+        Term frequency matrix of the ngrams (1 row per string, 1 column per ngram
+        of the vocabulary), with L2-normalized rows. The ngrams not yet in the
+        vocabulary are added to it.
+        """
+        rows: List[int] = []
+        cols: List[int] = []
+        values: List[int] = []
+        for i, ngram in enumerate(ngrams):
+            for k, v in ngram.d.items():
+                rows.append(i)
+                cols.append(vocabulary.setdefault(k, len(vocabulary)))
+                values.append(v)
+        m: sparse.csr_matrix = sparse.csr_matrix(
+            (np.array(values, dtype=np.float64), (rows, cols)),
+            shape=(len(ngrams), len(vocabulary)),
+        )
+        norms: np.ndarray = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+        norms[norms == 0] = 1  # Strings without any ngram: their similarities stay 0
+        return sparse.diags(1 / norms) @ m
+
+    @staticmethod
+    def similarity_matrix(
+        ngrams_1: List["Ngram"],
+        ngrams_2: List["Ngram"],
+    ) -> sparse.csr_matrix:
+        """
+        Cosine similarities of all the pairs of ngrams (sparse: pairs without any
+        common ngram are not stored), as the product of the normalized term
+        frequency matrices of both lists.
+        """
+        vocabulary: Dict[str, int] = {}
+        m1: sparse.csr_matrix = __class__.tf_matrix(ngrams_1, vocabulary)
+        m2: sparse.csr_matrix = __class__.tf_matrix(ngrams_2, vocabulary)
+        m1.resize(m1.shape[0], len(vocabulary))  # The vocabulary grew with ngrams_2
+        return (m1 @ m2.T).tocsr()
+
     @staticmethod
     def build_similarity_map(
         s1: Iterable[str], 
@@ -66,14 +110,11 @@ class Ngram:
         """
         ngrams_1: List[Ngram] = [Ngram(s=k, n=n) for k in s1]
         ngrams_2: List[Ngram] = [Ngram(s=k, n=n) for k in s2]
-
-        df = pd.concat([
-            pd.DataFrame(
-                {str(ngram_col): [ngram_col.sim(ngram_idx) for ngram_idx in ngrams_1]})
-            for ngram_col in ngrams_2
-        ], axis=1)
-        df.index = [str(k) for k in ngrams_1]
-        return df
+        return pd.DataFrame(
+            __class__.similarity_matrix(ngrams_1, ngrams_2).toarray(),
+            index=[str(k) for k in ngrams_1],
+            columns=[str(k) for k in ngrams_2],
+        )
     
 
 class DataMerger:
@@ -105,13 +146,12 @@ class DataMerger:
 
         df: pd.DataFrame = Ngram.build_similarity_map(s1, s2)
 
-        d, df2 = DataMerger.solve_similarity_map(df, 0.48)
+        d, pairs = DataMerger.solve_similarity_map(df, 0.48)
+        __class__.print_report(df, d, pairs)
         # Manually updating the outliers:
         d.update({
             "Côte d'Ivoire.png": "Ivory_Coast.png",  # Traduction
             "DR Congo.png": "Democratic_Republic_of_the_Congo.png",
-            "Macau.png": "Macao_S.A.R.png",
-            "Timor-Leste.png": "East_Timor.png",     # Traduction
         })
         # Loading flag df and adding column to merge
         df_flag = pd.read_csv(self.df_flag_path, sep=";")
@@ -152,40 +192,104 @@ class DataMerger:
         return df
     
     @staticmethod
-    def solve_similarity_map(df: pd.DataFrame, threshold: float) -> Tuple[
-            Dict[str, str], 
-            pd.DataFrame
-        ]:
-        d, df2 = __class__.__solve_similarity_map(df, threshold)
-        d_final: Dict[str, str] = {}
-        i: int = 1
-        while d:
-            print(f"solve_similarity_map | Step {i} | {len(d)} pairs created")
-            d_final = {**d_final, **d}
-            d, df2 = __class__.__solve_similarity_map(df2, threshold)
-        return d_final, df2
+    def solve_similarity_map(
+            df: pd.DataFrame,
+            threshold: float,
+            min_similarity: float = 0.25,
+            min_margin: float = 0.05,
+        ) -> Tuple[Dict[str, str], pd.DataFrame]:
+        """
+        Solves the similarity map and returns a mapping s1 => s2, with the
+        candidate pairs (index: s1, columns: s2, similarity, margin, matched).
 
+        The pairs are a one-to-one assignment maximizing the sum of the squared
+        similarities: squared, so that an exact match is never traded for two
+        partial ones. The margin of a pair is its similarity minus the best
+        other similarity of its row & column. A pair is matched if its
+        similarity reaches `threshold`, or `min_similarity` with a margin of at
+        least `min_margin` (e.g: "Macau" => "Macao S.A.R").
+        """
+        sim: np.ndarray = df.to_numpy()
+        weights: np.ndarray = np.where(sim >= min_similarity, sim ** 2, 0)
+        rows, cols = linear_sum_assignment(weights, maximize=True)
+        candidate: np.ndarray = weights[rows, cols] > 0
+        rows, cols = rows[candidate], cols[candidate]
 
+        others: np.ndarray = sim.copy()
+        others[rows, cols] = -np.inf
+        best_other: np.ndarray = np.maximum(others.max(axis=1)[rows], others.max(axis=0)[cols])
+        pairs: pd.DataFrame = pd.DataFrame({
+            "s2": df.columns[cols],
+            "similarity": sim[rows, cols],
+            "margin": sim[rows, cols] - best_other,
+        }, index=df.index[rows])
+        pairs["matched"] = (pairs["similarity"] >= threshold) | (pairs["margin"] >= min_margin)
+        return pairs.loc[pairs["matched"], "s2"].to_dict(), pairs
 
     @staticmethod
-    def __solve_similarity_map(df: pd.DataFrame, threshold: float) -> Tuple[
-            Dict[str, str], 
-            pd.DataFrame
-        ]:
-        """Solves the similarity map and returns a mapping s1 => s2"""
-        d_1: Dict[str, str] = {}
-        for name_1, row in df.iterrows():
-            s: pd.Series = row[row >= threshold].sort_values(ascending=False)
-            if len(s) >= 1:
-                d_1[name_1] = s.index[0]
-        d_2: Dict[str, str] = {}
-        for name_2, col in df.transpose().iterrows():
-            s: pd.Series = col[col >= threshold].sort_values(ascending=False)
-            if len(s) >= 1:
-                d_2[name_2] = s.index[0]
-        s = pd.Series(d_1)
-        d = s[s.map(d_2) == s.index].to_dict()
-        return d, df.loc[~df.index.isin(d.keys()), ~df.columns.isin(d.values())]
+    def print_report(df: pd.DataFrame, d: Dict[str, str], pairs: pd.DataFrame, min_margin: float = 0.05) -> None:
+        """Prints the unmatched items & the pairs matched with a low margin"""
+        print(f"solve_similarity_map | {len(d)} pairs created")
+        uncertain: pd.DataFrame = pairs[pairs["matched"] & (pairs["margin"] < min_margin)]
+        for name_1, row in uncertain.iterrows():
+            print(f"Low margin    | {name_1} => {row['s2']} ({row['similarity']:.2f}, margin {row['margin']:+.2f})")
+        print(f"Unmatched s1  | {sorted(set(df.index) - set(d.keys()))}")
+        print(f"Unmatched s2  | {sorted(set(df.columns) - set(d.values()))}")
+
+class SnapshotBuilder:
+    """
+    Compiles the merged dataframe into the snapshot loaded by the game (see snapshot.py):
+    rows are sorted & cleaned, image paths are computed, and the country
+    categories & continents are tagged in boolean columns.
+    """
+    # Countries of each category, kept in snapshot.py: they are part of the hash of the snapshot
+    categories: Dict[str, List[str]] = CATEGORIES
+
+    @staticmethod
+    def load_dataframe(csv_path: str) -> pd.DataFrame:
+        """Loads and process the merged dataframe"""
+        df: pd.DataFrame = pd.read_csv(csv_path, sep=";")
+        df.sort_values(by=["FINAL_GEOUNIT"], ascending=True, inplace=True)
+        df.reset_index(inplace=True, drop=True)
+        # Paths of the images, relative to the "files" folder
+        df["OUTLINE_IMAGE_PATH"] = "outlines/" + df["outline_file_name"]
+        df.loc[df["outline_unuseable"], "OUTLINE_IMAGE_PATH"] = None
+        df["FLAG_IMAGE_PATH"] = "flags/" + df["flag_file_name"]
+
+        m: pd.Series = df["name"].isna()
+        df.loc[m, "name"] = df.loc[m, "FINAL_GEOUNIT"]
+        return df
+
+    @staticmethod
+    def tag_data_with_info(df: pd.DataFrame) -> Tuple[List[str], List[str]]:
+        """Adds the category & continent columns, returns their names"""
+        for cat, elem_in_cat in __class__.categories.items():
+            df[cat] = df["FINAL_GEOUNIT"].isin(elem_in_cat).fillna(False)
+
+        # Continents
+        df.fillna(value={"continent": "Undefined"}, inplace=True)
+        set_cont: Set[str] = df["continent"].dropna().apply(
+            lambda x: x.split(",")[0]).unique()
+        for continent in set_cont:
+            df[f"continent_{continent}"] = df["continent"].str.contains(continent)
+        return [*__class__.categories.keys()], [*set_cont]
+
+    @staticmethod
+    def build(csv_path: str, folder: str) -> None:
+        """Writes the snapshot of the merged dataframe"""
+        df: pd.DataFrame = __class__.load_dataframe(csv_path)
+        categories, continents = __class__.tag_data_with_info(df)
+        columns: Dict[str, np.ndarray] = {}
+        for col in df.columns:
+            if pd.api.types.is_bool_dtype(df[col]):
+                columns[col] = df[col].to_numpy(dtype=bool)
+            elif pd.api.types.is_numeric_dtype(df[col]):
+                columns[col] = df[col].to_numpy(dtype=np.float64)
+            else:  # Strings, missing values are stored as empty strings
+                columns[col] = df[col].fillna("").astype(str).to_numpy(dtype=str)
+        save_snapshot(folder, columns, categories, continents, source_digest(csv_path))
+        print(f"Snapshot of {csv_path} written to {folder} ({len(df)} rows)")
+
 
 if __name__ == "__main__":
     dm = DataMerger(
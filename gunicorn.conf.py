@@ -0,0 +1,41 @@
+"""
+Gunicorn settings, see wsgi.py. Each can be overridden with an env variable:
+    WORLDLE_BIND, WORLDLE_WORKERS, WORLDLE_THREADS, WORLDLE_TIMEOUT
+"""
+import os
+import glob
+import shutil
+import tempfile
+import multiprocessing
+
+bind: str = os.environ.get("WORLDLE_BIND", "0.0.0.0:8050")
+# The callbacks are short & CPU bound: about one worker per core
+workers: int = int(os.environ.get("WORLDLE_WORKERS", multiprocessing.cpu_count()))
+# Threads let a worker keep serving the images while a callback runs
+threads: int = int(os.environ.get("WORLDLE_THREADS", 4))
+worker_class: str = "gthread"
+timeout: int = int(os.environ.get("WORLDLE_TIMEOUT", 30))
+# The app (and its data) is loaded once in the master, before forking the workers
+preload_app: bool = True
+accesslog: str = "-"
+
+
+# The workers write their metrics (see metrics.py) in this folder, so /metrics
+# reports all of them. By default, each master has its own folder, removed when it
+# exits. The metric files (*.db) of a previous run are deleted at startup, only them.
+DEFAULT_METRICS_DIR: str = os.path.join(tempfile.gettempdir(), f"worldle_metrics_{os.getpid()}")
+metrics_dir: str = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", DEFAULT_METRICS_DIR)
+os.makedirs(metrics_dir, mode=0o700, exist_ok=True)
+for path in glob.glob(os.path.join(metrics_dir, "*.db")):
+    os.remove(path)
+
+
+def child_exit(server, worker) -> None:
+    # The gauges of the workers that stopped are not reported anymore
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server) -> None:
+    if metrics_dir == DEFAULT_METRICS_DIR:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
@@ -0,0 +1,174 @@
+"""
+Lazy loading of the country images (outlines & flags).
+
+Images are only read from disk the first time they are requested, and are
+then kept in a LRU cache bounded by a byte budget. When an asset bundle is
+available (see asset_bundle.py), the images are read from it instead and are
+not copied in the cache. They are served to the
+browser by URL (see `ImageCache.url`). The URL is made of a hash of the
+content of the image only, so it can be cached forever by the browser, and
+it does not reveal the country it shows.
+"""
+import os
+import hashlib
+import mimetypes
+import threading
+from collections import OrderedDict
+
+from typing import Dict, Optional, Iterable, Set, Union
+
+# Default byte budget of the cache, can be overridden with an env variable (in MB)
+DEFAULT_MAX_BYTES: int = int(float(os.environ.get("WORLDLE_IMAGE_CACHE_MB", 16)) * 2 ** 20)
+# Prefix of the route serving the images
+IMAGE_URL_PREFIX: str = "/images"
+
+
+class ImageCache:
+    """
+    LRU cache of the raw image bytes, indexed by their path relative to `folder`
+    (e.g: "outlines/France.png"). Only the registered keys can be loaded.
+    The least recently used images are dropped as soon as the total size of
+    the cached data goes above `max_bytes`.
+    The images contained in `bundle` are served from it, without caching.
+    """
+
+    def __init__(
+            self,
+            folder: str = "files",
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            bundle: Optional["AssetBundle"] = None,
+        ) -> None:
+        self.folder: str = folder
+        self.max_bytes: int = max_bytes
+        self.bundle: Optional["AssetBundle"] = bundle
+        self._keys: Set[str] = set()
+        self._data: "OrderedDict[str, bytes]" = OrderedDict()
+        # The digests are tiny, we keep them even when the image is evicted
+        self._digests: Dict[str, str] = {}
+        # Digest => key, to find the image requested by an URL
+        self._keys_by_digest: Dict[str, str] = {}
+        # Whether the digests of all the registered images were computed
+        self._scanned: bool = False
+        self._n_bytes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        # Counters
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.bundle_reads: int = 0
+
+    def register(self, keys: Iterable[str], digests: Optional[Dict[str, str]] = None) -> None:
+        """
+        Declares the images that can be served. Their digests can be given
+        when they are already known, to avoid reading the images to compute them.
+        """
+        self._keys.update(keys)
+        self._scanned = False
+        if digests:
+            self._digests.update(digests)
+            self._keys_by_digest.update((d, k) for k, d in digests.items())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def get(self, key: str) -> Union[bytes, memoryview]:
+        """Returns the bytes of the image, loading it from disk if needed"""
+        if key not in self._keys:
+            raise KeyError(key)
+        if self.bundle is not None and key in self.bundle:
+            self.bundle_reads += 1
+            return self.bundle.get(key)
+        with self._lock:
+            data: Optional[bytes] = self._data.get(key)
+            if data is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        # Reading the file outside of the lock so other threads are not blocked
+        with open(os.path.join(self.folder, key), "rb") as f:
+            data = f.read()
+        with self._lock:
+            self._digests[key] = __class__.compute_digest(data)
+            self._keys_by_digest[self._digests[key]] = key
+            self._put(key, data)
+        return data
+
+    def digest(self, key: str) -> str:
+        """Hash of the content of the image"""
+        if self.bundle is not None and key in self.bundle:
+            digest: str = self.bundle.digest(key)
+            self._keys_by_digest[digest] = key
+            return digest
+        digest: Optional[str] = self._digests.get(key)
+        if digest is None:
+            self.get(key)
+            digest = self._digests[key]
+        return digest
+
+    def url(self, key: str) -> str:
+        """
+        URL of the image: its digest & extension. It changes whenever the content
+        of the image changes, and does not contain the name of the image.
+        """
+        return f"{IMAGE_URL_PREFIX}/{self.digest(key)}{os.path.splitext(key)[1]}"
+
+    def key_of(self, digest: str) -> Optional[str]:
+        """Key of the image with this digest, None if there is none"""
+        key: Optional[str] = self._keys_by_digest.get(digest)
+        if key is None and not self._scanned:
+            # The URL was built by another process: the digests of all the images
+            # are computed, once (the files are read without filling the cache)
+            for k in sorted(self._keys):
+                if self.bundle is not None and k in self.bundle:
+                    self.digest(k)
+                elif k not in self._digests:
+                    with open(os.path.join(self.folder, k), "rb") as f:
+                        d: str = __class__.compute_digest(f.read())
+                    with self._lock:
+                        self._digests[k] = d
+                        self._keys_by_digest[d] = k
+            self._scanned = True
+            key = self._keys_by_digest.get(digest)
+        return key
+
+    def _put(self, key: str, data: bytes) -> None:
+        """Adds an entry then evicts the oldest ones until we are within budget"""
+        if len(data) > self.max_bytes:  # Would evict everything, we do not keep it
+            return
+        if key in self._data:  # Another thread loaded it in the meantime
+            return
+        self._data[key] = data
+        self._n_bytes += len(data)
+        while self._n_bytes > self.max_bytes:
+            _, old = self._data.popitem(last=False)
+            self._n_bytes -= len(old)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._digests.clear()
+            self._keys_by_digest.clear()
+            self._scanned = False
+            self._n_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of the cache"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bundle_reads": self.bundle_reads,
+            "entries": len(self._data),
+            "bytes": self._n_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    @staticmethod
+    def compute_digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()[:16]
+
+    @staticmethod
+    def mimetype(key: str) -> str:
+        return mimetypes.guess_type(key)[0] or "application/octet-stream"
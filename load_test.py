@@ -0,0 +1,348 @@
+"""
+Load test of the app: simulates concurrent players, each playing through HTTP
+against the `_dash-update-component` endpoint like a browser would:
+reset -> guesses -> swap to explore mode -> guess -> swap back -> settings change.
+
+By default a gunicorn server (see wsgi.py) is started locally for the test:
+    python3 load_test.py --players 32 --duration 30 --workers 4
+Or an already running server can be targeted:
+    python3 load_test.py --url http://127.0.0.1:8050 --players 8
+
+Reports, for each callback, the throughput, the latency percentiles and the
+size of the responses. With --max-p95-ms / --min-rps, the exit code is 1 when
+the thresholds are not met, so it can be used to gate a release.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+import numpy as np
+from typing import List, Dict, Any, Tuple, Optional
+
+from ui import CONST
+
+
+class DashClient:
+    """Talks to the Dash endpoints over one keep-alive HTTP connection"""
+
+    def __init__(self, url: str, timeout: float = 30) -> None:
+        parts = urlsplit(url)
+        self.connection: http.client.HTTPConnection = http.client.HTTPConnection(
+            parts.hostname, parts.port or 80, timeout=timeout)
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        headers: Dict[str, str] = {"Content-Type": "application/json"} if body is not None else {}
+        self.connection.request(method, path, body=body, headers=headers)
+        response: http.client.HTTPResponse = self.connection.getresponse()
+        return response.status, response.read()
+
+    def get_json(self, path: str) -> Any:
+        status, data = self.request("GET", path)
+        if status != 200:
+            raise RuntimeError(f"GET {path}: HTTP {status}")
+        return json.loads(data)
+
+    def call(
+            self,
+            dependency: Dict[str, Any],
+            props: Dict[str, Dict[str, Any]],
+            changed: List[str],
+        ) -> Tuple[int, bytes]:
+        """Runs a callback with the current values of its inputs & states"""
+        outputs: List[Dict[str, str]] = []
+        for output in dependency["output"].strip(".").split("..."):
+            component_id, prop = output.rsplit(".", 1)
+            outputs.append({"id": component_id, "property": prop.split("@")[0]})
+        body: Dict[str, Any] = {
+            "output": dependency["output"],
+            "outputs": outputs if len(outputs) > 1 else outputs[0],
+            "changedPropIds": changed,
+        }
+        for kind in ("inputs", "state"):
+            body[kind] = [
+                {**d, "value": props.get(d["id"], {}).get(d["property"])}
+                for d in dependency[kind]
+            ]
+        return self.request("POST", "/_dash-update-component", json.dumps(body).encode("utf-8"))
+
+
+def find_props(node: Any, acc: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Props of the components of the layout, by id"""
+    if isinstance(node, dict):
+        props: Any = node.get("props")
+        if isinstance(props, dict) and "id" in props:
+            acc[props["id"]] = props
+        for value in node.values():
+            find_props(value, acc)
+    elif isinstance(node, list):
+        for value in node:
+            find_props(value, acc)
+    return acc
+
+
+def apply_update(current: Any, value: Any) -> Any:
+    """Applies the value of an output: either a new value, or a partial update (dash.Patch)"""
+    if not (isinstance(value, dict) and "__dash_patch_update" in value):
+        return value
+    current = dict(current) if isinstance(current, dict) else list(current or [])
+    for operation in value["operations"]:
+        # The players only need the top level keys of the status & the lists
+        location: List[Any] = operation["location"]
+        if operation["operation"] == "Assign" and len(location) == 1:
+            current[location[0]] = operation["params"]["value"]
+        elif operation["operation"] == "Delete" and len(location) == 1:
+            del current[location[0]]
+        elif operation["operation"] == "Append" and not location:
+            current.append(operation["params"]["value"])
+    return current
+
+
+class Stats:
+    """Latencies & response sizes of the calls, by callback"""
+
+    def __init__(self) -> None:
+        self._lock: threading.Lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.n_bytes: Dict[str, List[int]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, name: str, seconds: float, n_bytes: int, ok: bool) -> None:
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            self.n_bytes.setdefault(name, []).append(n_bytes)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, Dict[str, float]]:
+        result: Dict[str, Dict[str, float]] = {}
+        names: List[str] = sorted(self.latencies)
+        for name in names + ["total"]:
+            if name == "total":
+                latencies: np.ndarray = np.concatenate([self.latencies[n] for n in names]) * 1e3
+                n_bytes: np.ndarray = np.concatenate([self.n_bytes[n] for n in names])
+                errors: int = sum(self.errors.values())
+            else:
+                latencies = np.array(self.latencies[name]) * 1e3
+                n_bytes = np.array(self.n_bytes[name])
+                errors = self.errors.get(name, 0)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            result[name] = {
+                "calls": len(latencies),
+                "errors": errors,
+                "rps": len(latencies) / duration,
+                "p50_ms": p50,
+                "p95_ms": p95,
+                "p99_ms": p99,
+                "mean_bytes": n_bytes.mean(),
+                "max_bytes": int(n_bytes.max()),
+            }
+        return result
+
+
+class Player:
+    """A simulated player, with the state its browser would have"""
+
+    def __init__(
+            self,
+            url: str,
+            dependencies: List[Dict[str, Any]],
+            stats: Stats,
+            rng: random.Random,
+            guesses_per_round: int = 8,
+        ) -> None:
+        self.client: DashClient = DashClient(url)
+        self.stats: Stats = stats
+        self.rng: random.Random = rng
+        self.guesses_per_round: int = guesses_per_round
+        self.props: Dict[str, Dict[str, Any]] = find_props(self.client.get_json("/_dash-layout"), {})
+        # Server callbacks, by the input triggering them
+        self.dependencies: Dict[str, Dict[str, Any]] = {}
+        for dependency in dependencies:
+            if dependency.get("clientside_function") is None:
+                for d in dependency["inputs"]:
+                    self.dependencies.setdefault(d["id"], dependency)
+        # With WORLDLE_CLIENTSIDE_CHECK, the guesses go through the store-guess store
+        self.clientside_check: bool = CONST.ID.STORE_GUESS in self.dependencies
+        self.n_guesses: int = 0
+
+    def run(self, name: str, component_id: str, prop: str, value: Any) -> bool:
+        """Sets an input, runs the callback it triggers and applies its outputs"""
+        self.props.setdefault(component_id, {})[prop] = value
+        t: float = time.perf_counter()
+        status, data = self.client.call(
+            self.dependencies[component_id], self.props, [f"{component_id}.{prop}"])
+        ok: bool = status in (200, 204)
+        self.stats.record(name, time.perf_counter() - t, len(data), ok)
+        if status == 200:
+            for output_id, values in json.loads(data)["response"].items():
+                for output_prop, output_value in values.items():
+                    component: Dict[str, Any] = self.props.setdefault(output_id, {})
+                    component[output_prop] = apply_update(component.get(output_prop), output_value)
+        return ok
+
+    @property
+    def status(self) -> Dict[str, Any]:
+        return self.props[CONST.ID.STORE_STATUS]["data"]
+
+    def click(self, name: str, button_id: str) -> bool:
+        return self.run(name, button_id, "n_clicks", (self.props[button_id].get("n_clicks") or 0) + 1)
+
+    def guess(self, idx: int) -> bool:
+        self.n_guesses += 1
+        if not self.clientside_check:
+            return self.run("guess", CONST.ID.DROPDOWN_COUNTRY, "value", idx)
+        guess: Dict[str, Any] = {"n": self.n_guesses, "idx": idx}
+        if self.status["challenge"]:
+            guess["token"] = self.props[CONST.ID.STORE_ROUND]["data"]
+        return self.run("guess", CONST.ID.STORE_GUESS, "data", guess)
+
+    def random_country(self) -> int:
+        return self.rng.choice(self.props[CONST.ID.DROPDOWN_COUNTRY]["options"])["value"]
+
+    def change_settings(self) -> bool:
+        """Picks other continents, applied at the next reset"""
+        options: List[str] = self.props[CONST.ID.CHECKLIST_CONTINENT]["options"]
+        value: List[str] = self.rng.sample(options, self.rng.randint(2, len(options)))
+        return self.run("checklist", CONST.ID.CHECKLIST_CONTINENT, "value", value)
+
+    def play_round(self) -> None:
+        self.click("reset", CONST.ID.BUTTON_RESET)
+        for _ in range(self.guesses_per_round):
+            if self.status["n_questions"] >= self.status["n_total"]:  # All the countries were asked
+                break
+            # Right half of the time when the answer is known (token of the clientside
+            # check), else a random country of the game
+            if self.clientside_check and self.rng.random() < 0.5:
+                idx: int = self.props[CONST.ID.STORE_ROUND]["data"]["answer"]
+            else:
+                idx: int = self.random_country()
+            self.guess(idx)
+        self.click("mode", CONST.ID.BUTTON_MODE)
+        self.guess(self.random_country())
+        self.click("mode", CONST.ID.BUTTON_MODE)
+        self.change_settings()
+
+    def play(self, until: float) -> None:
+        while time.perf_counter() < until:
+            self.play_round()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers: int, threads: int, timeout: float = 120) -> Tuple[subprocess.Popen, str]:
+    """Starts gunicorn with the settings of gunicorn.conf.py, returns it once it answers"""
+    port: int = free_port()
+    env: Dict[str, str] = {
+        **os.environ,
+        "WORLDLE_BIND": f"127.0.0.1:{port}",
+        "WORLDLE_WORKERS": str(workers),
+        "WORLDLE_THREADS": str(threads),
+    }
+    server: subprocess.Popen = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:server"],
+        env=env,
+        stdout=subprocess.DEVNULL,  # Access log
+    )
+    url: str = f"http://127.0.0.1:{port}"
+    deadline: float = time.perf_counter() + timeout
+    while True:
+        try:
+            DashClient(url, timeout=1).get_json("/_dash-dependencies")
+            return server, url
+        except (OSError, RuntimeError):
+            if server.poll() is not None or time.perf_counter() > deadline:
+                server.kill()
+                raise RuntimeError("The server did not start")
+            time.sleep(0.1)
+
+
+def run_load_test(
+        url: str,
+        n_players: int,
+        duration: float,
+        guesses_per_round: int = 8,
+        seed: int = 0,
+    ) -> Dict[str, Dict[str, float]]:
+    dependencies: List[Dict[str, Any]] = DashClient(url).get_json("/_dash-dependencies")
+    stats: Stats = Stats()
+    players: List[Player] = [
+        Player(url, dependencies, stats, random.Random(seed + i), guesses_per_round)
+        for i in range(n_players)
+    ]
+    start: float = time.perf_counter()
+    threads: List[threading.Thread] = [
+        threading.Thread(target=player.play, args=(start + duration,)) for player in players
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats.summary(time.perf_counter() - start)
+
+
+def print_summary(summary: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'callback':<10} {'calls':>7} {'errors':>6} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'bytes':>8}")
+    for name, s in summary.items():
+        print(f"{name:<10} {s['calls']:>7} {s['errors']:>6} {s['rps']:>8.1f} "
+              f"{s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f} {s['mean_bytes']:>8.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Server to test, by default one is started locally")
+    parser.add_argument("--players", type=int, default=16, help="Number of concurrent players")
+    parser.add_argument("--duration", type=float, default=30, help="Duration of the test (s)")
+    parser.add_argument("--workers", type=int, default=2, help="Workers of the local server")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per worker of the local server")
+    parser.add_argument("--guesses-per-round", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Writes the report to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="Fails if the p95 latency is above")
+    parser.add_argument("--min-rps", type=float, help="Fails if the throughput is below")
+    args = parser.parse_args()
+
+    server: Optional[subprocess.Popen] = None
+    url: str = args.url
+    if url is None:
+        server, url = start_server(args.workers, args.threads)
+    try:
+        summary: Dict[str, Dict[str, float]] = run_load_test(
+            url, args.players, args.duration, args.guesses_per_round, args.seed)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print_summary(summary)
+    failures: List[str] = []
+    total: Dict[str, float] = summary["total"]
+    if total["errors"]:
+        failures.append(f"{total['errors']} calls failed")
+    if args.max_p95_ms is not None and total["p95_ms"] > args.max_p95_ms:
+        failures.append(f"p95 {total['p95_ms']:.2f} ms > {args.max_p95_ms} ms")
+    if args.min_rps is not None and total["rps"] < args.min_rps:
+        failures.append(f"throughput {total['rps']:.1f} req/s < {args.min_rps} req/s")
+    if args.json:
+        report: Dict[str, Any] = {
+            "config": {k: v for k, v in vars(args).items() if k != "json"},
+            "callbacks": summary,
+            "failures": failures,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
@@ -4,13 +4,17 @@ import random
 import base64
 
 import dash
+import flask
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
-import pandas as pd
 from typing import List, Dict, Any, Tuple, Optional
 
-from ui import UI, CONST
+from ui import UI, CONST, GameData, Status, CountryTable, PREFETCH_SIZE, shuffled_ids
+from image_cache import ImageCache, IMAGE_URL_PREFIX
+from answer_token import verify_token, CLIENTSIDE_CHECK
+from metrics import Instrumentation, METRICS_ENABLED
+from profiler import RequestProfiler, PROFILING_ENABLED
 
 NAME_COL: str = "FINAL_GEOUNIT"
 STYLE_BUTTON_CENTER: Dict[str, str] = {
@@ -21,99 +25,315 @@ STYLE_BUTTON_CENTER: Dict[str, str] = {
 
 app = dash.Dash(__name__)
 
-ui = UI()
+# Shared by all the sessions, the state of each game is stored in the browser
+data = GameData()
 
-app.layout = ui.build_layout()
+def serve_layout() -> html.Div:
+    """Each page load starts a new game"""
+    return UI(data).build_layout()
+
+app.layout = serve_layout
+
+if METRICS_ENABLED:  # Served on /metrics
+    Instrumentation(app, data.images.stats, lru_caches={
+        "eligible": CountryTable.eligible,
+        "dropdown_options": CountryTable.dropdown_options,
+        "shuffled_ids": shuffled_ids,
+    })
+if PROFILING_ENABLED:  # Some callback requests are profiled, see profiler.py
+    RequestProfiler(app)
+
+@app.server.route(f"{IMAGE_URL_PREFIX}/<file_name>")
+def serve_image(file_name: str) -> flask.Response:
+    """
+    Serves the outline & flag images. The URL is the hash of the image (and its
+    extension): the browser can cache it forever, and it does not give the answer.
+    """
+    digest, ext = os.path.splitext(file_name)
+    key: Optional[str] = data.images.key_of(digest)
+    if key is None or os.path.splitext(key)[1] != ext:
+        flask.abort(404)
+    # Images from the asset bundle are memoryviews: WSGI servers only accept bytes
+    response: flask.Response = flask.Response(
+        bytes(data.images.get(key)), mimetype=ImageCache.mimetype(key))
+    response.set_etag(digest)
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response.make_conditional(flask.request)
+
+def question_outputs(ui: UI) -> Tuple[Any, Any, Any]:
+    """
+    Image (src & srcSet) or text of the question. Only the one that is shown
+    is sent, the other one is left untouched in the browser.
+    """
+    ui.update_visuals()
+    if ui.s.show_image:
+        return ui.s.image_src, ui.s.image_srcset, dash.no_update
+    return dash.no_update, dash.no_update, ui.s.text_to_guess
+
+def prefetch_patch(ui: UI) -> Any:
+    """
+    After a new question was sampled: it leaves the queue of preloaded
+    images, and the image of the question entering the queue is added.
+    """
+    if not ui.s.show_image or PREFETCH_SIZE <= 0:  # No queue of preloaded images
+        return dash.no_update
+    patch: dash.Patch = dash.Patch()
+    # The question that was just sampled was the head of the queue
+    del patch[0]
+    upcoming: Tuple[int, ...] = ui.upcoming_ids()
+    if upcoming and len(upcoming) == PREFETCH_SIZE:
+        patch.append(ui.prefetch_image(upcoming[-1]))
+    return patch
+
+def session_ui(status: Dict[str, Any]) -> UI:
+    """Game logic of the session whose status was sent back by the browser"""
+    try:
+        return UI(data, Status.from_dict(status, data.table))
+    except ValueError:  # Not a status built by the server (forged, or signed with another key)
+        raise PreventUpdate
+
+def selected_idx(ui: UI, value: Any) -> int:
+    """Country selected in the dropdown: one of the countries of the game"""
+    try:
+        idx: int = int(value)
+    except (TypeError, ValueError):
+        raise PreventUpdate
+    if not 0 <= idx < ui.n or not (ui.s.eligible >> idx) & 1:
+        raise PreventUpdate
+    return idx
+
+def status_patch(status: Dict[str, Any], ui: UI) -> dash.Patch:
+    """Partial update of the status stored in the browser: only the fields that changed"""
+    patch: dash.Patch = dash.Patch()
+    for key, value in ui.s.to_dict().items():
+        if status.get(key) != value:
+            patch[key] = value
+    return patch
+
+# Each interaction has its own callback, sending only the properties it changes.
+# The question & the status are written by all of them (allow_duplicate), which
+# requires prevent_initial_call: the layout already holds the initial state.
+# The guess callback is registered below, depending on where answers are checked.
+
+def on_guess(value: str, status: Dict[str, Any]) -> Tuple[Any, ...]:
+    """A country was selected in the dropdown: answer in challenge mode, shown in explore mode"""
+    if value is None:  # No name was selected in the dropdown => we don't update anything
+        raise PreventUpdate
+    ui: UI = session_ui(status)
+    idx: int = selected_idx(ui, value)
+    if not ui.s.is_mode_challenge:  # Mode exploration, we show the selected country
+        ui.s.current_explore_idx = idx
+        return (
+            *question_outputs(ui),
+            dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update,
+            status_patch(status, ui),
+        )
+
+    labels: List[Optional[str]] = ui.table.labels(ui.s.quizz_target)
+    your_answer: str = labels[idx]
+    real_answer: str = labels[ui.s.current_guess_idx]
+    if idx == ui.s.current_guess_idx:
+        ui.s.answer = f"Congrats it was indeed: {your_answer}"
+        ui.s.answer_style = {"color": "green"}
+        ui.mark_correct(idx)
+    else:
+        ui.s.answer = f"No it was not {your_answer}, it was: {real_answer}"
+        ui.s.answer_style = {"color": "red"}
+    ui.sample_new_question()  # Rolling a new country
+
+    # Only the color changes, the rest of the style of the text is kept
+    answer_style: dash.Patch = dash.Patch()
+    answer_style["color"] = ui.s.answer_style["color"]
+    return (
+        *question_outputs(ui),
+        ui.s.answer,        # The text of the answer (are we right or wrong)
+        answer_style,       # The color of the answer (green or red)
+        None,               # The dropdown is emptied for the next guess
+        ui.s.score_text,    # Score text to show
+        prefetch_patch(ui), # Images of the next questions
+        status_patch(status, ui),
+    )
+
+def on_guess_checked(guess: Dict[str, Any], status: Dict[str, Any]) -> Tuple[Any, ...]:
+    """
+    The answer was already checked in the browser (see CHECK_ANSWER_JS): we record
+    the result and hand out the next question, with its token.
+    In explore mode, we show the selected country.
+    """
+    if not guess:
+        raise PreventUpdate
+    ui: UI = session_ui(status)
+    idx: int = selected_idx(ui, guess.get("idx"))
+    if not ui.s.is_mode_challenge:
+        ui.s.current_explore_idx = idx
+        return (*question_outputs(ui), dash.no_update, dash.no_update, status_patch(status, ui))
+
+    token: Dict[str, Any] = guess.get("token")
+    if not verify_token(token, ui.s.sid, ui.s.seed) or (
+            token["round"] != ui.s._n_questions or token["answer"] != ui.s.current_guess_idx):
+        raise PreventUpdate  # Forged, or a round that is not the current one anymore
+    if idx == ui.s.current_guess_idx:
+        ui.mark_correct(idx)
+    ui.sample_new_question()  # Rolling a new country
+    return (*question_outputs(ui), ui.answer_token(), prefetch_patch(ui), status_patch(status, ui))
+
+# Clientside check of the answer: the result & the score are shown right away, and
+# the guess is forwarded to the server (STORE_GUESS) for the next question.
+# Until the server answers, the guesses for the same question are ignored.
+CHECK_ANSWER_JS: str = """
+function(value, token, options, status, style, last_guess) {
+    if (value === null || value === undefined) {
+        throw window.dash_clientside.PreventUpdate;
+    }
+    const no_update = window.dash_clientside.no_update;
+    const n = last_guess ? last_guess.n + 1 : 0;
+    if (!status.challenge) {
+        return [no_update, no_update, no_update, no_update, {n: n, idx: value}];
+    }
+    if (last_guess && last_guess.token && last_guess.token.sig === token.sig) {
+        throw window.dash_clientside.PreventUpdate;
+    }
+    const label = (idx) => (options.find((o) => o.value === idx) || {}).label;
+    const ok = (value === token.answer);
+    const answer = ok
+        ? `Congrats it was indeed: ${label(value)}`
+        : `No it was not ${label(value)}, it was: ${label(token.answer)}`;
+    const score = `${status.n_correct + (ok ? 1 : 0)} / ${token.round} (Total: ${status.n_total})`;
+    return [
+        answer,
+        Object.assign({}, style, {color: ok ? "green" : "red"}),
+        score,
+        null,
+        {n: n, idx: value, token: token},
+    ];
+}
+"""
+
+if CLIENTSIDE_CHECK:
+    app.clientside_callback(
+        CHECK_ANSWER_JS,
+        Output(CONST.ID.TEXT_RESULT, "children"),
+        Output(CONST.ID.TEXT_RESULT, 'style'),
+        Output(CONST.ID.TEXT_SCORE, "children", allow_duplicate=True),
+        Output(CONST.ID.DROPDOWN_COUNTRY, 'value'),
+        Output(CONST.ID.STORE_GUESS, "data"),
+        Input(CONST.ID.DROPDOWN_COUNTRY, 'value'),
+        State(CONST.ID.STORE_ROUND, "data"),
+        State(CONST.ID.DROPDOWN_COUNTRY, 'options'),
+        State(CONST.ID.STORE_STATUS, "data"),
+        State(CONST.ID.TEXT_RESULT, 'style'),
+        State(CONST.ID.STORE_GUESS, "data"),
+        prevent_initial_call=True,
+    )
+    app.callback(
+        Output(CONST.ID.IMAGE_COUNTRY, 'src', allow_duplicate=True),
+        Output(CONST.ID.IMAGE_COUNTRY, 'srcSet', allow_duplicate=True),
+        Output(CONST.ID.TEXT_COUNTRY, "children", allow_duplicate=True),
+        Output(CONST.ID.STORE_ROUND, "data", allow_duplicate=True),  # Token of the next question
+        Output(CONST.ID.DIV_PREFETCH, "children", allow_duplicate=True),
+        Output(CONST.ID.STORE_STATUS, "data", allow_duplicate=True),
+        Input(CONST.ID.STORE_GUESS, "data"),        # Guess checked in the browser
+        State(CONST.ID.STORE_STATUS, "data"),
+        prevent_initial_call=True,
+    )(on_guess_checked)
+else:
+    app.callback(
+        Output(CONST.ID.IMAGE_COUNTRY, 'src', allow_duplicate=True),     # Country image
+        Output(CONST.ID.IMAGE_COUNTRY, 'srcSet', allow_duplicate=True),  # Resized variants of the country image
+        Output(CONST.ID.TEXT_COUNTRY, "children", allow_duplicate=True),
+        Output(CONST.ID.TEXT_RESULT, "children"),    # Content of the text showing the result
+        Output(CONST.ID.TEXT_RESULT, 'style'),       # Color of the text showing the result (red/green)
+        Output(CONST.ID.DROPDOWN_COUNTRY, 'value'),  # We reset the value of the dropdown after a guess
+        Output(CONST.ID.TEXT_SCORE, "children", allow_duplicate=True),  # Current score
+        Output(CONST.ID.DIV_PREFETCH, "children", allow_duplicate=True),  # Preloaded images
+        Output(CONST.ID.STORE_STATUS, "data", allow_duplicate=True),    # Status of the session
+        Input(CONST.ID.DROPDOWN_COUNTRY, 'value'),   # Dropdown value changed
+        State(CONST.ID.STORE_STATUS, "data"),
+        prevent_initial_call=True,
+    )(on_guess)
 
 @app.callback(
-    Output(CONST.ID.IMAGE_COUNTRY, 'src'),       # Country image
-    Output(CONST.ID.TEXT_COUNTRY, "children"),
-    Output(CONST.ID.TEXT_RESULT, "children"),    # Content of the text showing the result
-    Output(CONST.ID.DROPDOWN_COUNTRY, 'value'),  # We reset the value of the dropdown each time
-    Output(CONST.ID.DROPDOWN_COUNTRY, 'options'),  # We can change the options of the dropdown
-    Output(CONST.ID.TEXT_RESULT, 'style'),       # Color of the text showing the result (red/green)
-    Output(CONST.ID.TEXT_SCORE, "children"),     # Current score
+    Output(CONST.ID.IMAGE_COUNTRY, 'src', allow_duplicate=True),
+    Output(CONST.ID.IMAGE_COUNTRY, 'srcSet', allow_duplicate=True),
+    Output(CONST.ID.TEXT_COUNTRY, "children", allow_duplicate=True),
+    Output(CONST.ID.DROPDOWN_COUNTRY, 'options'),  # The options depend on the settings
+    Output(CONST.ID.TEXT_SCORE, "children", allow_duplicate=True),
+    Output(CONST.ID.DIV_IMAGE, "style"),           # Whether the image div should be shown
+    Output(CONST.ID.DIV_TEXT, "style"),            # Whether the text div should be shown
+    Output(CONST.ID.DIV_PREFETCH, "children", allow_duplicate=True),  # Images of the next questions
+    Output(CONST.ID.STORE_STATUS, "data", allow_duplicate=True),
+    # Token of the first question, when the answers are checked in the browser
+    *([Output(CONST.ID.STORE_ROUND, "data", allow_duplicate=True)] if CLIENTSIDE_CHECK else []),
+    Input(CONST.ID.BUTTON_RESET, 'n_clicks'),      # Reset button clicked
+    State(CONST.ID.STORE_STATUS, "data"),
+    # Settings of the game, applied on reset
+    State(CONST.ID.CHECKLIST_CATEGORY, "value"),
+    State(CONST.ID.CHECKLIST_CONTINENT, "value"),
+    State(CONST.ID.RADIOITEMS_QUIZ_INPUT, "value"),
+    State(CONST.ID.RADIOITEMS_QUIZ_TARGET, "value"),
+    prevent_initial_call=True,
+)
+def on_reset(
+        n_clicks_reset_btn: int,
+        status: Dict[str, Any],      # Status of the session
+        checklist_cat: List[str],
+        checklist_continent: List[str],
+        quiz_input: str,
+        quiz_target: str,
+    ) -> Tuple[Any, ...]:
+    """Starts a new game with the settings of the left panel"""
+    ui: UI = session_ui(status)
+    # The dropdown options only depend on these, they are only sent when they change
+    options_key: Tuple[str, int] = (ui.s.quizz_target, ui.s.eligible)
+    was_showing_image: bool = ui.s.show_image
+
+    ui.apply_settings(checklist_cat, checklist_continent, quiz_input, quiz_target)
+    ui.reset_game()
+    ui.sample_new_question()
+
+    if (ui.s.quizz_target, ui.s.eligible) != options_key:
+        ui.update_dropdown_options()
+        dropdown_options: Any = ui.s.dropdown_options
+    else:  # The browser already has them
+        dropdown_options: Any = dash.no_update
+    if ui.s.show_image != was_showing_image:
+        div_styles: Tuple[Any, Any] = (ui.s.style_image_div, ui.s.style_text_div)
+    else:
+        div_styles: Tuple[Any, Any] = (dash.no_update, dash.no_update)
+    return (
+        *question_outputs(ui),
+        dropdown_options,
+        ui.s.score_text,
+        *div_styles,
+        ui.prefetch_images(),
+        status_patch(status, ui),
+        *([ui.answer_token()] if CLIENTSIDE_CHECK else []),
+    )
+
+@app.callback(
+    Output(CONST.ID.IMAGE_COUNTRY, 'src', allow_duplicate=True),
+    Output(CONST.ID.IMAGE_COUNTRY, 'srcSet', allow_duplicate=True),
+    Output(CONST.ID.TEXT_COUNTRY, "children", allow_duplicate=True),
     Output(CONST.ID.TEXT_TITLE, "children"),     # Title at the top of the screen (showing mode)
     Output(CONST.ID.BUTTON_MODE, 'children'),    # Text on the challenge/exploration button
-    Output(CONST.ID.DIV_IMAGE, "style"),
-    Output(CONST.ID.DIV_TEXT, "style"),
-    Input(CONST.ID.DROPDOWN_COUNTRY, 'value'),   # Dropdown value changed
-    Input(CONST.ID.BUTTON_RESET, 'n_clicks'),    # Reset button clicked
+    Output(CONST.ID.STORE_STATUS, "data", allow_duplicate=True),
     Input(CONST.ID.BUTTON_MODE, 'n_clicks'),     # Mode button clicked
-    # prevent_initial_call=True  
+    State(CONST.ID.STORE_STATUS, "data"),
+    prevent_initial_call=True,
 )
-def update_image(
-        value: str,                  # Dropdown: country guess
-        n_clicks_reset_btn: int,     # Reset Button
-        n_clicks_swapmode_btn: int,  # 
-    ) -> Tuple[str, str, Optional[str], Dict[str, str], str, str]:
-
-    # The callback context gives {prop id}.{prop attribute} (e.g: dropdown.value)
-    triggered_input_id: str = dash.callback_context.triggered[0]['prop_id'].split(".")[0]  
-    if triggered_input_id == CONST.ID.BUTTON_RESET:
-        # In this case we reset everything.
-        ui.reset_dataframe()
-        ui.sample_new_question()
-        ui.update_dropdown_options()
-        if ui.s.quizz_input_value == "Outline":
-            ui.s.image_data = ui.df.loc[ui.s.current_explore_idx, CONST.COL.OUTLINE_IMAGE_DATA]
-        elif ui.s.quizz_input_value == "Flag":
-            ui.s.image_data = ui.df.loc[ui.s.current_explore_idx, CONST.COL.FLAG_IMAGE_DATA]
-
-    elif triggered_input_id == CONST.ID.BUTTON_MODE:
-        # In this case we want to swap the mode of the game
-        # The mode is swapping between challenge and explore, starting in challenge.
-        ui.s.is_mode_challenge = not ui.s.is_mode_challenge
-        if ui.s.is_mode_challenge:  # If we are now in mode challenge
-            pass
-        else:  # We are in mode exploration
-            # The index of the country will be the first value in the data 
-            # that matches the quizz right now
-            ui.s.current_explore_idx = ui.df[ui.df[CONST.COL.CHALL_ELIGIBLE]].index[0]
-
-    elif triggered_input_id == CONST.ID.DROPDOWN_COUNTRY:
-        if value is None:  # No name was selected in the dropdown => we don't update anything
-            raise PreventUpdate
-        idx: int = int(value)
-        if ui.s.is_mode_challenge: # Mode challenge
-            if ui.s.quizz_target == "Name":
-                target_col: str = CONST.COL.NAME
-            elif ui.s.quizz_target == "Capital":
-                target_col: str = CONST.COL.CAPITAL
-            else:
-                raise NotImplementedError
-            your_answer: str = ui.df.loc[idx, target_col]
-            real_answer: str = ui.df.loc[ui.s.current_guess_idx, target_col]
-
-            if idx == ui.s.current_guess_idx:
-                ui.s.answer = f"Congrats it was indeed: {your_answer}"
-                ui.s.answer_style = {"color": "green"}
-                ui.df.loc[idx, CONST.COL.CHALL_CORRECT] = True
-            else:
-                ui.s.answer = f"No it was not {your_answer}, it was: {real_answer}"
-                ui.s.answer_style = {"color": "red"}
-            ui.sample_new_question()  # Rolling a new country
-
-        else:  # Mode exploration
-            ui.s.current_explore_idx = idx
-            ui.s.dropdown_value_idx = idx
-
-    ui.update_score()
-    ui.update_visuals()
-    ui.update_dropdown_options()
-
+def on_swap_mode(n_clicks_swapmode_btn: int, status: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Swaps between challenge and explore mode, starting in challenge"""
+    ui: UI = session_ui(status)
+    ui.s.is_mode_challenge = not ui.s.is_mode_challenge
+    if not ui.s.is_mode_challenge:  # We are now in mode exploration
+        # The index of the country will be the first value in the data 
+        # that matches the quizz right now
+        ui.s.current_explore_idx = ui.first_eligible()
     return (
-        ui.s.image_data,           # What image to show as hint
-        ui.s.text_to_guess,        # What text to show as hint
-        ui.s.answer,               # The text of the answer (are we right or wrong)
-        ui.s.dropdown_value_idx,   # Value in the dropdown (often None ie nothing select)
-        ui.s.dropdown_options,
-        ui.s.answer_style,         # The style of the answer (green or red)
-        ui.s.score_text,           # Score text to show
+        *question_outputs(ui),
         ui.s.header_title_text,    # What text should be at the top of the screen
         ui.s.mode_button_text,     # What text should be on the mode button
-        ui.s.style_image_div,      # Whether the image div should be shown
-        ui.s.style_text_div        # Whether the text div should be shown
+        status_patch(status, ui),
     )
 
 @app.callback(
@@ -131,19 +351,15 @@ def update_cat_checklist(
     quiz_target: str,
 ) -> str:
     """
-    If we change the country categories, this will simply update
-    the attribute in the UI class.
+    If we change the country categories, this will show how many
+    countries would be in the game after a reset.
     """
-    ui.s.categories = {cat: cat in checklist_cat for cat in ui.s.categories}
-    ui.s.continents = {cont: cont in checklist_continent for cont in ui.s.continents}
-
-    ui.s.quizz_input_value = quiz_input
-    ui.s.quizz_target_value = quiz_target
-    
+    ui: UI = UI(data, Status())
+    ui.apply_settings(checklist_cat, checklist_continent, quiz_input, quiz_target)
     ui.update_theoric_total()
     return ui.s.theoric_total
 
 
 # Run the app
 if __name__ == '__main__':
-    app.run_server(debug=False)
\ No newline at end of file
+    app.run(debug=False)
\ No newline at end of file
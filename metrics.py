@@ -0,0 +1,168 @@
+"""
+Instrumentation of the server, exposed in the Prometheus text format on /metrics.
+
+Every Dash callback is measured (latency & size of the response, by callback),
+as well as the images served, the number of active sessions and the counters
+of the caches. Everything is recorded by Flask hooks around the requests: the
+callbacks themselves are untouched, and new callbacks are measured as well.
+
+When several processes serve the app (gunicorn), PROMETHEUS_MULTIPROC_DIR must
+point to a folder shared by the processes, without the metric files (*.db) of a
+previous run (gunicorn.conf.py sets it up):
+/metrics then reports the metrics of all the workers, whichever answers.
+Set WORLDLE_METRICS=0 to disable the instrumentation.
+"""
+import os
+import time
+import threading
+
+import flask
+import dash
+from prometheus_client import (
+    Counter, Gauge, Histogram, CollectorRegistry, REGISTRY,
+    generate_latest, CONTENT_TYPE_LATEST, multiprocess,
+)
+from typing import Dict, Any, Optional, Callable, List, Tuple
+
+from image_cache import IMAGE_URL_PREFIX
+
+METRICS_ENABLED: bool = os.environ.get("WORLDLE_METRICS", "1") == "1"
+MULTIPROCESS: bool = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+CALLBACK_PATH: str = "/_dash-update-component"
+# A session is active if it ran a callback during this period (s)
+SESSION_TIMEOUT: float = 300
+# The cache counters are copied to the gauges at most this often (s)
+CACHE_REFRESH_PERIOD: float = 1
+
+CALLBACK_LATENCY: Histogram = Histogram(
+    "worldle_callback_duration_seconds", "Time to run a Dash callback", ["callback"],
+    buckets=[.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5],
+)
+CALLBACK_BYTES: Histogram = Histogram(
+    "worldle_callback_response_bytes", "Size of the responses of a Dash callback", ["callback"],
+    buckets=[128, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144],
+)
+CALLBACK_ERRORS: Counter = Counter(
+    "worldle_callback_errors_total", "Dash callbacks that failed (HTTP 5xx)", ["callback"],
+)
+IMAGE_REQUESTS: Counter = Counter(
+    "worldle_image_requests_total", "Requests of images, by HTTP status", ["status"],
+)
+IMAGE_BYTES: Counter = Counter(
+    "worldle_image_bytes_served_total", "Bytes of the images sent to the browsers",
+)
+ACTIVE_SESSIONS: Gauge = Gauge(
+    "worldle_active_sessions", f"Sessions that ran a callback in the last {SESSION_TIMEOUT:.0f} s "
+    "(summed over the workers: a session served by several workers is counted by each)",
+    multiprocess_mode="livesum",
+)
+IMAGE_CACHE: Gauge = Gauge(
+    "worldle_image_cache", "Counters of the image cache, see ImageCache.stats", ["stat"],
+    multiprocess_mode="livesum",
+)
+LRU_CACHE: Gauge = Gauge(
+    "worldle_lru_cache", "Counters of the memoized functions (functools.lru_cache)", ["cache", "stat"],
+    multiprocess_mode="livesum",
+)
+
+
+def callback_name(app: dash.Dash, output: str) -> str:
+    """Name of the function of a callback, from the "output" field of the requests"""
+    entry: Optional[Dict[str, Any]] = app.callback_map.get(output)
+    return entry["callback"].__name__ if entry else "unknown"
+
+
+class Instrumentation:
+    """Flask hooks recording the metrics of the requests served by `app`"""
+
+    def __init__(
+            self,
+            app: dash.Dash,
+            image_stats: Callable[[], Dict[str, int]],
+            lru_caches: Dict[str, Callable],
+        ) -> None:
+        """
+        image_stats: returns the counters of the image cache
+        lru_caches: the functions decorated by functools.lru_cache, by name
+        """
+        self.app: dash.Dash = app
+        self.image_stats: Callable[[], Dict[str, int]] = image_stats
+        self.lru_caches: Dict[str, Callable] = lru_caches
+        # Metrics of the callbacks (latency, bytes, errors), by their outputs
+        self._callback_metrics: Dict[str, Tuple[Any, Any, Any]] = {}
+        # Session id => last time it ran a callback
+        self._sessions: Dict[str, float] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self._last_refresh: float = 0
+
+        server: flask.Flask = app.server
+        server.before_request(self.before_request)
+        server.after_request(self.after_request)
+        server.add_url_rule("/metrics", "metrics", self.serve_metrics)
+
+    def callback_metrics(self, output: str) -> Tuple[Any, Any, Any]:
+        """Metrics of a callback, labelled by the name of its function"""
+        metrics: Optional[Tuple[Any, Any, Any]] = self._callback_metrics.get(output)
+        if metrics is None:
+            name: str = callback_name(self.app, output)
+            metrics = (CALLBACK_LATENCY.labels(name), CALLBACK_BYTES.labels(name), CALLBACK_ERRORS.labels(name))
+            self._callback_metrics[output] = metrics
+        return metrics
+
+    def before_request(self) -> None:
+        if flask.request.path == CALLBACK_PATH:
+            flask.g.metrics_start = time.perf_counter()
+
+    def after_request(self, response: flask.Response) -> flask.Response:
+        path: str = flask.request.path
+        if path == CALLBACK_PATH and "metrics_start" in flask.g:
+            # The body was already parsed (and cached) by Dash
+            body: Dict[str, Any] = flask.request.get_json(silent=True) or {}
+            latency, n_bytes, errors = self.callback_metrics(body.get("output", ""))
+            latency.observe(time.perf_counter() - flask.g.metrics_start)
+            n_bytes.observe(response.content_length or 0)
+            if response.status_code >= 500:
+                errors.inc()
+            self.record_session(body)
+        elif path.startswith(IMAGE_URL_PREFIX + "/"):
+            IMAGE_REQUESTS.labels(str(response.status_code)).inc()
+            if response.status_code == 200:
+                IMAGE_BYTES.inc(response.content_length or 0)
+        now: float = time.monotonic()
+        if now - self._last_refresh > CACHE_REFRESH_PERIOD:
+            self.refresh(now)
+        return response
+
+    def record_session(self, body: Dict[str, Any]) -> None:
+        """The session id is in the status, sent as a state by the callbacks using it"""
+        for item in body.get("state", []):
+            value: Any = item.get("value")
+            if isinstance(value, dict) and "sid" in value:
+                with self._lock:
+                    self._sessions[value["sid"]] = time.monotonic()
+                return
+
+    def refresh(self, now: float) -> None:
+        """Copies the counters that are only known by this process to the gauges"""
+        self._last_refresh = now
+        with self._lock:
+            expired: List[str] = [
+                sid for sid, t in self._sessions.items() if now - t > SESSION_TIMEOUT]
+            for sid in expired:
+                del self._sessions[sid]
+            ACTIVE_SESSIONS.set(len(self._sessions))
+        for stat, value in self.image_stats().items():
+            IMAGE_CACHE.labels(stat).set(value)
+        for cache, func in self.lru_caches.items():
+            info = func.cache_info()
+            for stat in ("hits", "misses", "currsize", "maxsize"):
+                LRU_CACHE.labels(cache, stat).set(getattr(info, stat) or 0)
+
+    def serve_metrics(self) -> flask.Response:
+        self.refresh(time.monotonic())
+        if MULTIPROCESS:
+            registry: CollectorRegistry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry: CollectorRegistry = REGISTRY
+        return flask.Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
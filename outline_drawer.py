@@ -10,9 +10,15 @@ Two files are needed:
 """
 import os
 import io
-import time
+import json
+import hashlib
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from PIL import Image
+from PIL import Image, ImageDraw
+import numpy as np
+import shapely
 import pyproj
 import geopandas as gpd
 import pandas as pd
@@ -20,10 +26,30 @@ import tqdm
 import matplotlib
 import matplotlib.pyplot as plt
 from shapely.ops import transform
-from typing import List, Any, Dict, Set
+from typing import List, Any, Dict, Set, Optional, Tuple, Callable
 matplotlib.use('Agg')
 
 NAME_COL = "NAME_EN"
+RENDER_BACKENDS: Tuple[str, ...] = ("matplotlib", "direct")
+# Size of the outlines drawn by the "direct" backend (px), close to the matplotlib ones
+OUTLINE_SIZE: int = 2310
+# Margin around the country, as matplotlib's (5% of the extent on each side), in fraction of the size
+OUTLINE_MARGIN: float = 0.05 / 1.1
+# Width of the edges, as matplotlib's (1 pt at 300 dpi, ~4 px on 2310 px), in fraction of the size
+OUTLINE_EDGE_WIDTH: float = 0.0018
+# The "direct" backend draws at this many times the size, then downsamples (antialiasing)
+SUPERSAMPLING: int = 2
+OUTLINES_CSV_PATH: str = os.path.join("files", "df_outlines.csv")
+# Hashes of the geometries of the drawn outlines, to only redraw the ones that changed
+OUTLINES_MANIFEST_PATH: str = os.path.join("files", "outlines_manifest.json")
+MANIFEST_VERSION: int = 1
+# To increase when the drawing of the outlines changes: everything is then redrawn
+RENDER_VERSION: int = 1
+# Largest distance between a simplified geometry and the original one, in pixels of the outline
+SIMPLIFY_PIXELS: float = 0.5
+# To increase when the simplification changes: the cached geometries are then simplified again
+SIMPLIFY_VERSION: int = 1
+SIMPLIFIED_FOLDER: str = os.path.join("files", "raw", "simplified")
 
 
 def shift_geometry(geometry, offset: float):
@@ -37,43 +63,350 @@ def shift_geometry(geometry, offset: float):
     ).transform
     return transform(project, geometry)
 
+
+# Figure & axes reused by all the outlines drawn by a process
+_figure: Optional[Tuple[Any, Any]] = None
+
+
+def render_outline(geometry: gpd.GeoSeries, file_path: str) -> None:
+    """
+    Draws the geometry of a country (white on black) to a square image.
+    Module-level, to be run by the processes of a pool.
+    """
+    global _figure
+    if _figure is None:
+        _figure = plt.subplots(figsize=(10, 10))
+        _figure[0].patch.set_facecolor('black')
+    fig, ax = _figure
+    ax.clear()
+    ax.set_facecolor('black')
+    geometry.plot(ax=ax, facecolor='white', edgecolor='white')
+    ax.set_axis_off()
+    # We write the image to a PIL Image
+    buf = io.BytesIO()
+    fig.savefig(
+        buf, format='png', bbox_inches='tight',
+        pad_inches=0, facecolor='black', dpi=300)
+    buf.seek(0)
+    # We ensure that the image is square
+    image: Image = Image.open(buf)
+    image = OutlineDrawer.square_image(image)
+    image.save(file_path)
+
+
+def geometry_digest(geometry: gpd.GeoSeries) -> str:
+    """Hash of the geometries of a country, independent of the order of its rows"""
+    h = hashlib.sha256()
+    for wkb in sorted(shapely.to_wkb(np.asarray(geometry.values, dtype=object))):
+        h.update(hashlib.sha256(wkb).digest())
+    h.update(str(geometry.crs).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def load_outlines_manifest(path: str = OUTLINES_MANIFEST_PATH) -> Optional[Dict[str, Any]]:
+    """The manifest of the drawn outlines, None if it does not exist or is outdated"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        manifest: Dict[str, Any] = json.load(f)
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+
+def shapefile_digest(path: str) -> str:
+    """Hash of a shapefile: its geometries (.shp) & attributes (.dbf)"""
+    h = hashlib.sha256()
+    for ext in (".shp", ".dbf"):
+        file_path: str = os.path.splitext(path)[0] + ext
+        if os.path.exists(file_path):
+            with open(file_path, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()[:16]
+
+
+def make_valid_polygons(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Repairs the invalid polygons as GeoDataFrame.overlay does: the rows that are
+    no longer polygons afterwards are dropped
+    """
+    if not gdf.geom_type.isin(["Polygon", "MultiPolygon"]).all() or gdf.geometry.is_valid.all():
+        return gdf
+    gdf = gdf.copy()
+    invalid: pd.Series = ~gdf.geometry.is_valid
+    gdf.loc[invalid, gdf.geometry.name] = gdf.loc[invalid, gdf.geometry.name].make_valid()
+    # make_valid can return collections: only their polygons are kept
+    collection: pd.Series = gdf.geom_type == "GeometryCollection"
+    gdf.loc[collection, gdf.geometry.name] = gdf.loc[collection, gdf.geometry.name].apply(
+        lambda geom: shapely.union_all([g for g in geom.geoms if g.geom_type in ("Polygon", "MultiPolygon")]))
+    return gdf[gdf.geom_type.isin(["Polygon", "MultiPolygon"])]
+
+
+def polygon_parts(geometry: gpd.GeoSeries) -> np.ndarray:
+    """The polygons of the geometries, largest first (lines & points are dropped)"""
+    parts: np.ndarray = np.asarray(geometry.values, dtype=object)
+    # Multi-polygons & collections (made by the overlays) are split until only simple geometries remain
+    while len(parts) and shapely.get_type_id(parts).max() >= 4:
+        parts = shapely.get_parts(parts)
+    parts = parts[shapely.get_type_id(parts) == 3]
+    parts = parts[~shapely.is_empty(parts)]
+    return parts[np.argsort(-shapely.area(parts), kind="stable")]
+
+
+def rasterize_outline(geometry: gpd.GeoSeries, file_path: str, size: int = OUTLINE_SIZE) -> None:
+    """
+    Draws the geometry of a country (white on black) to a square image of `size`
+    pixels without matplotlib: all the coordinates are projected at once to the
+    pixels of the image, and the polygons are filled by PIL.
+    """
+    polygons: np.ndarray = polygon_parts(geometry)
+    canvas_size: int = size * SUPERSAMPLING
+    canvas: Image.Image = Image.new("L", (canvas_size, canvas_size), 0)
+    if len(polygons):
+        x_min, y_min, x_max, y_max = shapely.total_bounds(polygons)
+        # Same aspect as geopandas: the longitudes are shrunk by the cosine of the latitude
+        aspect: float = 1.0
+        if geometry.crs is not None and geometry.crs.is_geographic:
+            aspect = 1 / np.cos(np.radians((y_min + y_max) / 2))
+        extent: float = max(x_max - x_min, (y_max - y_min) * aspect) or 1.0
+        scale: float = canvas_size * (1 - 2 * OUTLINE_MARGIN) / extent
+
+        rings, polygon_idx = shapely.get_rings(polygons, return_index=True)
+        coords: np.ndarray = shapely.get_coordinates(rings)
+        coords = np.column_stack([
+            canvas_size / 2 + (coords[:, 0] - (x_min + x_max) / 2) * scale,
+            canvas_size / 2 - (coords[:, 1] - (y_min + y_max) / 2) * scale * aspect,
+        ])
+        ring_coords: List[np.ndarray] = np.split(coords, np.cumsum(shapely.get_num_coordinates(rings))[:-1])
+        edge_width: int = max(1, round(OUTLINE_EDGE_WIDTH * canvas_size))
+
+        draw: ImageDraw.ImageDraw = ImageDraw.Draw(canvas)
+        # Each polygon is drawn over the larger ones: islands in lakes stay visible
+        first_rings: np.ndarray = np.flatnonzero(np.diff(polygon_idx, prepend=-1))
+        for start, end in zip(first_rings, [*first_rings[1:], len(rings)]):
+            xy: List[List[float]] = [ring_coords[k].ravel().tolist() for k in range(start, end)]
+            draw.polygon(xy[0], fill=255)
+            for hole in xy[1:]:
+                draw.polygon(hole, fill=0)
+            for ring in xy:
+                draw.line(ring, fill=255, width=edge_width)
+    if SUPERSAMPLING > 1:
+        canvas = canvas.reduce(SUPERSAMPLING)
+    canvas.save(file_path)
+
+
 class OutlineDrawer:
     """
     Draws outline from naturalearthdata.com data.
     https://www.naturalearthdata.com/downloads/10m-cultural-vectors/10m-admin-0-countries/
     """
 
+    # Map units merged into a single country: GEOUNIT => FINAL_GEOUNIT
+    unit_merges: Dict[str, str] = {
+        # Georgia
+        "Ajaria": "Georgia",
+        "Georgia": "Georgia",
+        # Cyprus
+        "Akrotiri Sovereign Base Area": "Cyprus",
+        "Dhekelia Sovereign Base Area": "Cyprus",
+        "Cyprus No Mans Area": "Cyprus",
+        "Northern Cyprus": "Cyprus",
+        "Cyprus": "Cyprus",
+        # Antigua & Barbuda
+        "Antigua": "Antigua and Barbuda",
+        "Barbuda": "Antigua and Barbuda",
+        # Bosnia and Herzegovina
+        "Brcko District": "Bosnia and Herzegovina",
+        "Bosnia and Herzegovina": "Bosnia and Herzegovina",
+        "Republic Srpska": "Bosnia and Herzegovina",
+        # Solomon Islands
+        "Bougainville": "Solomon Islands",
+        # Belgium
+        "Brussels Capital Region": "Belgium",
+        "Flemish Region": "Belgium",
+        "Walloon Region": "Belgium",
+        # Iraq
+        "Iraqi Kurdistan": "Iraq",
+        "Iraq": "Iraq",
+        # Kazakhstan
+        "Baykonur Cosmodrome": "Kazakhstan",
+        "Kazakhstan": "Kazakhstan",
+        # South Korea
+        "Korean Demilitarized Zone (south)": "South Korea",
+        "South Korea": "South Korea",
+        # North Korea
+        "Korean Demilitarized Zone (north)": "North Korea",
+        "North Korea": "North Korea",
+        # United Kingdom
+        "Northern Ireland": "United Kingdom",
+        "Scotland": "United Kingdom",
+        "Wales": "United Kingdom",
+        "England": "United Kingdom",
+        # Somalia
+        "Puntland": "Somalia",
+        "Somalia": "Somalia",
+        "Somaliland": "Somalia",
+        # Serbia
+        "Serbia": "Serbia",
+        "Vojvodina" : "Serbia",
+        # Tanzania
+        "Zanzibar": "Tanzania",
+        "Tanzania": "Tanzania",
+    }
+    # Countries on both sides of the antimeridian, shifted by this longitude to be drawn in one piece
+    geometry_shift: Dict[str, float] = {
+        "Russia": 180,
+        "United States of America": 180,
+        "New Zealand": 180,
+        "Fiji": 180,
+        "Kiribati": 180,
+    }
+
     def __init__(
             self, 
             path_lake: str,
             path_no_lake: str,
             debug: bool = False,
+            processes: Optional[int] = None,
+            backend: str = "matplotlib",
+            size: int = OUTLINE_SIZE,
+            force: bool = False,
+            simplify: bool = True,
         ) -> None:
-        print("Loading naturalearthdata.com data")
-        gdf_lake: gpd.GeoDataFrame = gpd.read_file(path_lake)
-        gdf_nolake: gpd.GeoDataFrame = gpd.read_file(path_no_lake)
-        self.df: gpd.GeoDataFrame = self.remove_lakes(gdf_lake, gdf_nolake)
+        """
+        processes: number of processes drawing the outlines (default: 1 per CPU)
+        backend: "matplotlib", or "direct" to rasterize the outlines with PIL
+        size: size of the outlines drawn by the "direct" backend (px)
+        force: draws all the outlines, even the ones that did not change
+        simplify: simplifies the geometries to the resolution of the outlines first
+        """
+        gdf_lake, gdf_nolake = __class__.load_geometries(
+            path_lake, path_no_lake, size if backend == "direct" else OUTLINE_SIZE, simplify)
+        self.df: gpd.GeoDataFrame = self.remove_lakes(gdf_lake, gdf_nolake, threads=processes or os.cpu_count() or 1)
         self.df = self.merge_countries()
 
         self.df.sort_values(NAME_COL, inplace=True)
         self.df.reset_index(inplace=True, drop=True)
 
         self.shift_countries()
-        self.draw_all_countries()
+        self.draw_all_countries(processes or os.cpu_count() or 1, backend, size, force)
     
+    @staticmethod
+    def load_geometries(
+            path_lake: str,
+            path_no_lake: str,
+            size: int,
+            simplify: bool = True,
+        ) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+        """
+        Loads both datasets, simplified for outlines of `size` pixels. The simplified
+        geometries are cached in SIMPLIFIED_FOLDER, the cache depending on the source
+        files, the size & the settings of the simplification.
+        """
+        if not simplify:
+            print("Loading naturalearthdata.com data")
+            return gpd.read_file(path_lake), gpd.read_file(path_no_lake)
+        key: Dict[str, Any] = {
+            "version": SIMPLIFY_VERSION,
+            "size": size,
+            "pixels": SIMPLIFY_PIXELS,
+            "margin": OUTLINE_MARGIN,
+            "sources": [shapefile_digest(path_lake), shapefile_digest(path_no_lake)],
+            "unit_merges": __class__.unit_merges,
+            "geometry_shift": __class__.geometry_shift,
+        }
+        digest: str = hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        cache_path: str = os.path.join(SIMPLIFIED_FOLDER, f"{digest}.gpkg")
+        if os.path.exists(cache_path):
+            print(f"Loading the simplified geometries from {cache_path}")
+            return gpd.read_file(cache_path, layer="lake"), gpd.read_file(cache_path, layer="nolake")
+
+        print("Loading naturalearthdata.com data")
+        gdf_lake: gpd.GeoDataFrame = gpd.read_file(path_lake)
+        gdf_nolake: gpd.GeoDataFrame = gpd.read_file(path_no_lake)
+        n_before: int = shapely.get_num_coordinates(gdf_lake.geometry.values).sum() \
+            + shapely.get_num_coordinates(gdf_nolake.geometry.values).sum()
+        gdf_lake, gdf_nolake = __class__.simplify_geometries(gdf_lake, gdf_nolake, size)
+        n_after: int = shapely.get_num_coordinates(gdf_lake.geometry.values).sum() \
+            + shapely.get_num_coordinates(gdf_nolake.geometry.values).sum()
+        print(f"Geometries simplified for {size} px outlines: {n_before} => {n_after} vertices")
+
+        # Written under another name first: an interrupted run leaves no partial cache
+        os.makedirs(SIMPLIFIED_FOLDER, exist_ok=True)
+        tmp_path: str = cache_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        gdf_lake.to_file(tmp_path, layer="lake", driver="GPKG")
+        gdf_nolake.to_file(tmp_path, layer="nolake", driver="GPKG")
+        os.replace(tmp_path, cache_path)
+        return gdf_lake, gdf_nolake
+
+    @staticmethod
+    def simplification_tolerances(gdf_lake: gpd.GeoDataFrame, size: int) -> np.ndarray:
+        """
+        Tolerance of the simplification of each map unit (degrees): SIMPLIFY_PIXELS
+        pixels of the outline of its country, drawn on `size` pixels
+        """
+        country: pd.Series = gdf_lake["GEOUNIT"].map(__class__.unit_merges).fillna(gdf_lake["GEOUNIT"])
+        geometries: np.ndarray = gdf_lake.geometry.to_numpy()
+        tolerances: np.ndarray = np.zeros(len(gdf_lake))
+        for country_name, idx in country.groupby(country).indices.items():
+            offset: float = __class__.geometry_shift.get(country_name, 0)
+            if offset:  # The extent of the country once shifted (see shift_countries)
+                coords: np.ndarray = shapely.get_coordinates(geometries[idx])
+                x: np.ndarray = (coords[:, 0] - offset + 180) % 360 - 180
+                x_min, x_max = x.min(), x.max()
+                y_min, y_max = coords[:, 1].min(), coords[:, 1].max()
+            else:
+                x_min, y_min, x_max, y_max = shapely.total_bounds(geometries[idx])
+            # Same projection as the outlines (see rasterize_outline)
+            aspect: float = 1 / np.cos(np.radians((y_min + y_max) / 2))
+            extent: float = max(x_max - x_min, (y_max - y_min) * aspect)
+            # Size of a pixel in latitude, smaller than in longitude (degrees)
+            pixel: float = extent / (size * (1 - 2 * OUTLINE_MARGIN)) / aspect
+            tolerances[idx] = SIMPLIFY_PIXELS * pixel
+        return tolerances
+
+    @staticmethod
+    def simplify_geometries(
+            gdf_lake: gpd.GeoDataFrame,
+            gdf_nolake: gpd.GeoDataFrame,
+            size: int,
+        ) -> Tuple[gpd.GeoDataFrame, gpd.GeoDataFrame]:
+        """
+        Simplifies the geometries to the resolution of the outlines of their
+        countries, keeping their topology (no self-intersections, no holes or
+        islands removed). The no-lake geometries span several map units (France
+        & its overseas territories): each of their polygons is simplified with
+        the smallest tolerance of the map units of the same sovereign it meets.
+        """
+        tolerances: np.ndarray = __class__.simplification_tolerances(gdf_lake, size)
+        gdf_lake = gdf_lake.copy()
+        gdf_lake[gdf_lake.geometry.name] = gpd.GeoSeries(shapely.simplify(
+            gdf_lake.geometry.to_numpy(), tolerances, preserve_topology=True), index=gdf_lake.index, crs=gdf_lake.crs)
+
+        geometries: np.ndarray = gdf_nolake.geometry.to_numpy()
+        parts, part_row = shapely.get_parts(geometries, return_index=True)
+        idx_part, idx_lake = gdf_lake.sindex.query(parts, predicate="intersects")
+        same_sov: np.ndarray = gdf_nolake["SOVEREIGNT"].to_numpy()[part_row[idx_part]] \
+            == gdf_lake["SOVEREIGNT"].to_numpy()[idx_lake]
+        part_tolerances: np.ndarray = np.full(len(parts), np.inf)
+        np.minimum.at(part_tolerances, idx_part[same_sov], tolerances[idx_lake[same_sov]])
+        # The polygons not used by any map unit are left as is
+        part_tolerances[np.isinf(part_tolerances)] = 0
+        parts = shapely.simplify(parts, part_tolerances, preserve_topology=True)
+
+        simplified: np.ndarray = shapely.multipolygons(parts, indices=part_row, out=geometries.copy())
+        single: np.ndarray = shapely.get_type_id(geometries) == 3
+        simplified[single] = shapely.get_geometry(simplified[single], 0)
+        gdf_nolake = gdf_nolake.copy()
+        gdf_nolake[gdf_nolake.geometry.name] = gpd.GeoSeries(simplified, index=gdf_nolake.index, crs=gdf_nolake.crs)
+        return gdf_lake, gdf_nolake
+
     def shift_countries(self):
         """
         Some countries like Russia, new zealand, are distorted because
         they are on the left & right side of the used common projection
         """
-        geometry_shift: Dict[str, float] = {
-            "Russia": 180,
-            "United States of America": 180,
-            "New Zealand": 180,
-            "Fiji": 180,
-            "Kiribati": 180,
-        }
-        for country_name, offset in geometry_shift.items():
+        for country_name, offset in __class__.geometry_shift.items():
             m: pd.Series = self.df["FINAL_GEOUNIT"] == country_name
             self.df.loc[m, "geometry"] = self.df.loc[m, "geometry"].apply(
                 lambda geom: shift_geometry(geom, offset)
@@ -82,60 +415,8 @@ class OutlineDrawer:
 
     def merge_countries(self) -> gpd.GeoDataFrame:
         """Manually merges country together"""
-
-        d_map: Dict[str, str] = {
-            # Georgia
-            "Ajaria": "Georgia",
-            "Georgia": "Georgia",
-            # Cyprus
-            "Akrotiri Sovereign Base Area": "Cyprus",
-            "Dhekelia Sovereign Base Area": "Cyprus",
-            "Cyprus No Mans Area": "Cyprus",
-            "Northern Cyprus": "Cyprus",
-            "Cyprus": "Cyprus",
-            # Antigua & Barbuda
-            "Antigua": "Antigua and Barbuda",
-            "Barbuda": "Antigua and Barbuda",
-            # Bosnia and Herzegovina
-            "Brcko District": "Bosnia and Herzegovina",
-            "Bosnia and Herzegovina": "Bosnia and Herzegovina",
-            "Republic Srpska": "Bosnia and Herzegovina",
-            # Solomon Islands
-            "Bougainville": "Solomon Islands",
-            # Belgium
-            "Brussels Capital Region": "Belgium",
-            "Flemish Region": "Belgium",
-            "Walloon Region": "Belgium",
-            # Iraq
-            "Iraqi Kurdistan": "Iraq",
-            "Iraq": "Iraq",
-            # Kazakhstan
-            "Baykonur Cosmodrome": "Kazakhstan",
-            "Kazakhstan": "Kazakhstan",
-            # South Korea
-            "Korean Demilitarized Zone (south)": "South Korea",
-            "South Korea": "South Korea",
-            # North Korea
-            "Korean Demilitarized Zone (north)": "North Korea",
-            "North Korea": "North Korea",
-            # United Kingdom
-            "Northern Ireland": "United Kingdom",
-            "Scotland": "United Kingdom",
-            "Wales": "United Kingdom",
-            "England": "United Kingdom",
-            # Somalia
-            "Puntland": "Somalia",
-            "Somalia": "Somalia",
-            "Somaliland": "Somalia",
-            # Serbia
-            "Serbia": "Serbia",
-            "Vojvodina" : "Serbia",
-            # Tanzania
-            "Zanzibar": "Tanzania",
-            "Tanzania": "Tanzania",
-        }
         self.df.reset_index(inplace=True, drop=True)
-        self.df["FINAL_GEOUNIT"] = self.df["GEOUNIT"].map(d_map)  # Initializing column as empty
+        self.df["FINAL_GEOUNIT"] = self.df["GEOUNIT"].map(__class__.unit_merges)  # Initializing column as empty
         m = self.df["FINAL_GEOUNIT"].isna()
         self.df.loc[m, "FINAL_GEOUNIT"] = self.df.loc[m, "GEOUNIT"]
         return self.df
@@ -145,43 +426,96 @@ class OutlineDrawer:
             self, 
             gdf_lake: gpd.GeoDataFrame,
             gdf_nolake: gpd.GeoDataFrame,
+            threads: int = 1,
         ) -> gpd.GeoDataFrame:
-        out: List[pd.DataFrame] = []
-        pbar = tqdm.tqdm(enumerate(gdf_lake["GEOUNIT"].sort_values().items()), desc="")
-        nrows: int = len(gdf_lake)
-        for j, (idx, country_name) in pbar:
-            pbar.set_description(f"Removing lakes: {country_name} ({j + 1} / {nrows})")
-
-            df_country_lake: gpd.GeoDataFrame = gdf_lake[gdf_lake["GEOUNIT"] == country_name]
-            sov: str = df_country_lake["SOVEREIGNT"].iloc[0]
-            df_country_no_lake: gpd.GeoDataFrame = gdf_nolake[gdf_nolake["SOVEREIGNT"] == sov]
-            if df_country_no_lake.empty:
-                print(f"No no-lake data for {country_name} (sovereignty = {sov})")
-            else:
-                df = df_country_lake.overlay(
-                    right=df_country_no_lake[["geometry"]],
-                    how="intersection",
-                    keep_geom_type=False
-                )
-                out.append(df)
-        return pd.concat(out)
-
-    def draw_all_countries(self) -> None:
+        """
+        Intersects each map unit with the countries without lakes of its sovereign.
+        The pairs of geometries that intersect are found at once with a spatial
+        index, the intersections are computed in bulk (in `threads` chunks: shapely
+        releases the GIL). The rows are ordered by GEOUNIT, the same as intersecting
+        each GEOUNIT separately with GeoDataFrame.overlay.
+        """
+        lake: gpd.GeoDataFrame = make_valid_polygons(gdf_lake)
+        nolake: gpd.GeoDataFrame = make_valid_polygons(gdf_nolake)
+        # Every row of a GEOUNIT is intersected with the sovereign of its first row
+        sov: np.ndarray = lake.groupby("GEOUNIT", sort=False)["SOVEREIGNT"].transform("first").to_numpy()
+        missing: Set[str] = set(lake["GEOUNIT"][~np.isin(sov, nolake["SOVEREIGNT"].to_numpy())])
+        for country_name in sorted(missing):
+            print(f"No no-lake data for {country_name} (sovereignty = {sov[lake['GEOUNIT'] == country_name][0]})")
+
+        idx_lake, idx_nolake = nolake.sindex.query(lake.geometry, predicate="intersects")
+        same_sov: np.ndarray = sov[idx_lake] == nolake["SOVEREIGNT"].to_numpy()[idx_nolake]
+        idx_lake, idx_nolake = idx_lake[same_sov], idx_nolake[same_sov]
+        # Order of the overlays of the GEOUNITs: by name, then by rows of both frames
+        rank: np.ndarray = lake["GEOUNIT"].rank(method="dense").to_numpy().astype(int)
+        order: np.ndarray = np.lexsort((idx_nolake, idx_lake, rank[idx_lake]))
+        idx_lake, idx_nolake = idx_lake[order], idx_nolake[order]
+
+        left: np.ndarray = lake.geometry.to_numpy()[idx_lake]
+        right: np.ndarray = nolake.geometry.to_numpy()[idx_nolake]
+        chunks: List[np.ndarray] = np.array_split(np.arange(len(left)), max(1, min(threads, len(left))))
+        print(f"Removing lakes: {len(left)} intersections ({len(lake)} map units, {threads} threads)")
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            parts: List[np.ndarray] = list(pool.map(lambda c: shapely.intersection(left[c], right[c]), chunks))
+        geometries: np.ndarray = np.concatenate(parts) if parts else np.empty(0, dtype=object)
+        polygonal: np.ndarray = np.isin(shapely.get_type_id(geometries), [3, 6])
+        geometries[polygonal] = shapely.make_valid(geometries[polygonal])
+
+        out: gpd.GeoDataFrame = gpd.GeoDataFrame(
+            lake.drop(columns=lake.geometry.name).iloc[idx_lake].reset_index(drop=True),
+            geometry=gpd.GeoSeries(geometries, crs=lake.crs),
+        )
+        # A GEOUNIT in k rows was overlaid k times, each overlay indexed from 0
+        blocks: List[np.ndarray] = []
+        index: List[np.ndarray] = []
+        pair_rank: np.ndarray = rank[idx_lake]
+        starts: np.ndarray = np.searchsorted(pair_rank, np.arange(1, rank.max() + 2))
+        for r, count in enumerate(np.bincount(rank)[1:]):
+            block: np.ndarray = np.arange(starts[r], starts[r + 1])
+            blocks += [block] * count
+            index += [np.arange(len(block))] * count
+        out = out.iloc[np.concatenate(blocks)]
+        out.index = np.concatenate(index)
+        return out
+
+    def draw_all_countries(
+            self,
+            processes: int = 1,
+            backend: str = "matplotlib",
+            size: int = OUTLINE_SIZE,
+            force: bool = False,
+        ) -> None:
+        """
+        Draws the outline of each country, in a pool of processes if `processes` > 1.
+        The images & files/df_outlines.csv do not depend on the number of processes.
+
+        Only the outlines whose geometry changed since the last run are drawn again
+        (or all of them if `force` or the drawing settings changed): the hash of the
+        geometry of each country is kept in files/outlines_manifest.json.
+        """
+        if backend not in RENDER_BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {RENDER_BACKENDS}")
+        render: Callable[[gpd.GeoSeries, str], None] = render_outline
+        if backend == "direct":
+            render = functools.partial(rasterize_outline, size=size)
+        settings: Dict[str, Any] = {
+            "render_version": RENDER_VERSION,
+            "backend": backend,
+            "size": size if backend == "direct" else None,
+        }
+        previous: Dict[str, Any] = load_outlines_manifest() or {}
+        previous_outlines: Dict[str, Any] = previous.get("outlines", {})
+        # Outlines that can be kept if their geometry did not change
+        reusable: Dict[str, Any] = {} if force or previous.get("settings") != settings else previous_outlines
+
         # We iterate on the sub-unit (separating France from its islands etc...)
         self.df.sort_values(by="FINAL_GEOUNIT", inplace=True)
         self.df.reset_index(inplace=True, drop=True)
-        pbar = tqdm.tqdm(enumerate(self.df["FINAL_GEOUNIT"].unique()), desc="")
-        nrows: int = len(self.df)
         out_records: List[Dict[str, str]] = []
-        for j, country_name in pbar:
-            pbar.set_description(f"Drawing country outlines: {country_name} ({j} / {nrows})")
-            df = self.df.loc[self.df["FINAL_GEOUNIT"] == country_name, :]
-
-            fig, ax = plt.subplots(figsize=(10, 10))
-            fig.patch.set_facecolor('black')
-            ax.set_facecolor('black')
-            df.plot(ax=ax, facecolor='white', edgecolor='white')
-            ax.set_axis_off()
+        outlines: Dict[str, Dict[str, str]] = {}
+        geometries: List[gpd.GeoSeries] = []
+        file_paths: List[str] = []
+        for country_name, df in self.df.groupby("FINAL_GEOUNIT", sort=True):
             # We remove all non-alphanum characters and replace spaces with underscore
             file_name: str = __class__.get_file_name(country_name)
             file_path: str = f"files/outlines/{file_name}.png"
@@ -190,25 +524,43 @@ class OutlineDrawer:
                 "outline_file_path": file_path,
                 "FINAL_GEOUNIT": country_name,
             })
-            # We write the image to a PIL Image
-            buf = io.BytesIO()
-            plt.savefig(
-                buf, format='png', bbox_inches='tight', 
-                pad_inches=0, facecolor='black', dpi=300)
-            buf.seek(0)
-            # We ensure that the image is square
-            image: Image = Image.open(buf)
-            image = __class__.square_image(image)
-            image.save(file_path)
-            time.sleep(1)
-            try:
-                plt.close()
-            except:
-                pass
-        df_path: str = "files/df_outlines.csv"
+            outlines[f"{file_name}.png"] = {
+                "FINAL_GEOUNIT": country_name,
+                "geometry_digest": geometry_digest(df.geometry),
+            }
+            if reusable.get(f"{file_name}.png") != outlines[f"{file_name}.png"] \
+                    or not os.path.exists(file_path):
+                geometries.append(df.geometry)
+                file_paths.append(file_path)
+
+        desc: str = f"Drawing country outlines ({backend}, {processes} processes)"
+        if processes > 1 and len(file_paths) > 1:
+            with ProcessPoolExecutor(max_workers=min(processes, len(file_paths))) as pool:
+                # Consuming the results re-raises the errors of the workers
+                for _ in tqdm.tqdm(
+                        pool.map(render, geometries, file_paths, chunksize=4),
+                        total=len(file_paths), desc=desc):
+                    pass
+        else:
+            for geometry, file_path in tqdm.tqdm(zip(geometries, file_paths), total=len(file_paths), desc=desc):
+                render(geometry, file_path)
+
+        # The outlines of the countries that disappeared are removed
+        removed: List[str] = [key for key in previous_outlines if key not in outlines]
+        for key in removed:
+            if os.path.exists(os.path.join("files", "outlines", key)):
+                os.remove(os.path.join("files", "outlines", key))
+
         df = pd.DataFrame.from_records(out_records)
-        df.to_csv(df_path, sep=";", index=False)
-        
+        df.to_csv(OUTLINES_CSV_PATH, sep=";", index=False)
+        with open(OUTLINES_MANIFEST_PATH, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "settings": settings,
+                "outlines": outlines,
+            }, f, indent=1, ensure_ascii=False)
+        print(f"{len(file_paths)} outlines drawn, {len(outlines) - len(file_paths)} unchanged, {len(removed)} removed")
+
     @staticmethod
     def get_file_name(country_name: str) -> str:
         if len(country_name) == 0: raise ValueError("Empty country name")
@@ -247,10 +599,23 @@ class OutlineDrawer:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draws the outlines of all countries to files/outlines")
+    parser.add_argument("--processes", type=int, default=None, help="Default: 1 per CPU")
+    parser.add_argument("--backend", choices=RENDER_BACKENDS, default="matplotlib")
+    parser.add_argument("--size", type=int, default=OUTLINE_SIZE, help="Size of the outlines of the direct backend (px)")
+    parser.add_argument("--force", action="store_true", help="Draws all the outlines, even the unchanged ones")
+    parser.add_argument("--no-simplify", action="store_true", help="Keeps the full resolution geometries")
+    args = parser.parse_args()
+
     shp_path_with_lakes: str = os.path.join("files", "raw", "ne_10m_admin_0_map_units", "ne_10m_admin_0_map_units.shp")
     # shp_path_with_lakes: str = os.path.join("files", "raw", "ne_10m_admin_0_countries_iso", "ne_10m_admin_0_countries_iso.shp")
     shp_path_without_lakes: str = os.path.join("files", "raw", "ne_10m_admin_0_countries_lakes", "ne_10m_admin_0_countries_lakes.shp")
     
     od = OutlineDrawer(
         path_lake=shp_path_with_lakes,
-        path_no_lake=shp_path_without_lakes)
+        path_no_lake=shp_path_without_lakes,
+        processes=args.processes,
+        backend=args.backend,
+        size=args.size,
+        force=args.force,
+        simplify=not args.no_simplify)
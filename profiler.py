@@ -0,0 +1,133 @@
+"""
+Opt-in profiling of individual callback requests.
+
+A profiled request is traced (sys.setprofile) from the start to the end of its
+handling, and the time spent in each call stack is written in the "folded"
+format read by flamegraph.pl, speedscope or inferno: one line per stack,
+"frame;frame;frame <microseconds>". The callbacks only last a few milliseconds,
+too short for a sampling profiler: every call is recorded instead, which makes
+the profiled requests several times slower.
+
+Requests are profiled:
+    - at random, with the probability WORLDLE_PROFILE_RATE (e.g: 0.01)
+    - on demand, with the header "X-Worldle-Profile: <WORLDLE_PROFILE_TOKEN>"
+      (only when WORLDLE_PROFILE_TOKEN is set)
+The profiles are written to WORLDLE_PROFILE_DIR (default: "profiles"), named after
+the time, the callback and the input that triggered it.
+"""
+import os
+import re
+import sys
+import hmac
+import time
+import random
+import threading
+
+import flask
+import dash
+from typing import Dict, Any, List, Tuple, Optional
+
+from metrics import callback_name, CALLBACK_PATH
+
+PROFILE_RATE: float = float(os.environ.get("WORLDLE_PROFILE_RATE", 0))
+PROFILE_TOKEN: str = os.environ.get("WORLDLE_PROFILE_TOKEN", "")
+PROFILE_DIR: str = os.environ.get("WORLDLE_PROFILE_DIR", "profiles")
+PROFILE_HEADER: str = "X-Worldle-Profile"
+PROFILING_ENABLED: bool = PROFILE_RATE > 0 or bool(PROFILE_TOKEN)
+
+
+class StackProfiler:
+    """Records the time spent in each call stack of the current thread"""
+
+    def __init__(self) -> None:
+        self.stack: List[str] = []
+        # Stack => time spent in its last frame (s)
+        self.times: Dict[Tuple[str, ...], float] = {}
+        self._last: float = 0
+
+    @staticmethod
+    def frame_name(frame: Any) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _record(self, frame: Any, event: str, arg: Any) -> None:
+        now: float = time.perf_counter()
+        key: Tuple[str, ...] = tuple(self.stack)
+        self.times[key] = self.times.get(key, 0) + now - self._last
+        if event == "call":
+            self.stack.append(__class__.frame_name(frame))
+        elif event == "c_call":
+            self.stack.append(f"{getattr(arg, '__qualname__', arg)} (builtin)")
+        elif self.stack and event in ("return", "c_return", "c_exception"):
+            self.stack.pop()
+        self._last = time.perf_counter()  # The time spent here is not counted
+
+    def start(self) -> None:
+        self._last = time.perf_counter()
+        sys.setprofile(self._record)
+
+    def stop(self) -> None:
+        sys.setprofile(None)
+
+    def folded(self, root: str) -> str:
+        """The profile in the folded format, the stacks starting with `root`"""
+        lines: List[str] = []
+        for stack, seconds in self.times.items():
+            us: int = round(seconds * 1e6)
+            if us > 0:
+                lines.append(f"{';'.join((root, *stack))} {us}")
+        return "\n".join(lines) + "\n"
+
+
+class RequestProfiler:
+    """Flask hooks profiling some of the callback requests of `app`"""
+
+    def __init__(
+            self,
+            app: dash.Dash,
+            folder: str = PROFILE_DIR,
+            rate: float = PROFILE_RATE,
+            token: str = PROFILE_TOKEN,
+        ) -> None:
+        self.app: dash.Dash = app
+        self.folder: str = folder
+        self.rate: float = rate
+        self.token: str = token
+        self._local: threading.local = threading.local()
+        os.makedirs(folder, exist_ok=True)
+        app.server.before_request(self.before_request)
+        app.server.after_request(self.after_request)
+
+    def should_profile(self) -> bool:
+        header: str = flask.request.headers.get(PROFILE_HEADER, "")
+        # Compared as bytes: compare_digest only takes ASCII strings, the header comes from the client
+        if self.token and hmac.compare_digest(header.encode("utf-8"), self.token.encode("utf-8")):
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+    def before_request(self) -> None:
+        self._local.profiler = None
+        if flask.request.path != CALLBACK_PATH or not self.should_profile():
+            return
+        self._local.profiler = StackProfiler()
+        self._local.profiler.start()
+
+    def after_request(self, response: flask.Response) -> flask.Response:
+        profiler: Optional[StackProfiler] = getattr(self._local, "profiler", None)
+        if profiler is None:
+            return response
+        profiler.stop()
+        self._local.profiler = None
+
+        body: Dict[str, Any] = flask.request.get_json(silent=True) or {}
+        name: str = callback_name(self.app, body.get("output", ""))
+        trigger: str = ",".join(body.get("changedPropIds") or []) or "initial"
+        now: float = time.time()
+        file_name: str = "{}.{:03d}_{}_{}_{}.folded".format(
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(now)), int(now * 1000) % 1000, name,
+            re.sub(r"[^A-Za-z0-9.,-]", "_", trigger)[:100], os.getpid(),
+        )
+        with open(os.path.join(self.folder, file_name), "w", encoding="utf-8") as f:
+            f.write(profiler.folded(root=f"{name} [{trigger}]"))
+        response.headers[PROFILE_HEADER] = file_name
+        return response
@@ -0,0 +1,159 @@
+"""
+Precompiled snapshot of the game dataset.
+
+Preparing the game data from files/merged_df.csv (sorting, cleaning, tagging the
+categories & continents) is done once, by `SnapshotBuilder` in data.py. The result
+is written column by column as .npy files, next to a json header holding the
+version of the format and the hash of its sources: the CSV and the lists of the
+countries of each category. The game memory-maps the columns, and the snapshot
+is only rebuilt when the sources change.
+"""
+import os
+import json
+import hashlib
+
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+SNAPSHOT_VERSION: int = 1
+CSV_PATH: str = os.path.join("files", "merged_df.csv")
+SNAPSHOT_FOLDER: str = os.path.join("files", "snapshot")
+META_FILE: str = "meta.json"
+# Countries of each category, tagged in boolean columns by `SnapshotBuilder`
+CATEGORIES: Dict[str, List[str]] = {
+    "Small islands" : [
+        "Aland", "Cabo Verde", "Falkland Islands",
+        "Faroe Islands", "Isle of Man", "Kiribati", "Maldives", 
+        "Malta", "Jamaica", "New Caledonia", "Taiwan", 
+        "Puerto Rico", "Solomon Islands", "Svalbard", "The Bahamas", 
+    ],
+    "Very small islands": [
+        "Wallis and Futuna", "Vanuatu", "United States Virgin Islands", 
+        "Tuvalu", "Turks and Caicos Islands", "Trinidad and Tobago", "Tonga",
+        "Spratly Islands", "South Georgia and the Islands", "Seychelles",
+        "São Tomé and Principe", "Samoa", "Saint Vincent and the Grenadines",
+        "Saint Pierre and Miquelon", "Saint Lucia", "Saint Kitts and Nevis",
+        "Reunion", "Pitcairn Islands", "Paracel Islands", "Palau", 
+        "Northern Mariana Islands", "Norfolk Island", "Niue", "Montserrat",
+        "Mayotte", "Mauritius", "Martinique", "Marshall Islands","Madeira",
+        "Madeira", "Jersey", "Guernsey", "Guam", "Guadeloupe", "Grenada", 
+        "French Southern and Antarctic Lands", "French Polynesia", 
+        "Fiji", "Federated States of Micronesia", "Dominica", 
+        "Curaçao", "Cook Islands", "Comoros", "Christmas Islands",
+        "Cocos (Keeling) Islands", "Cayman Islands", "Carribean Netherlands",
+        "British Virgin Islands", "British Indian Ocean Territory", 
+        "Bermuda", "Barbados", "Azores", "Aruba", "Antigua and Barbuda",
+        "Anguilla", "American Samoa", 
+    ],
+    "Small Land Countries": [
+        "Bahrain", "Andorra", "Brunei",
+        "Djibouti", "East Timor",
+        "Hong Kong S.A.R.", "Macao S.A.R",
+        "Kuwait", "Qatar",
+        "Liechtenstein", "San Marino"
+        "Singapore", "Eswatini"
+    ],
+    "Ill-shaped": [
+        "Vatican", "Monaco", 
+    ]
+}
+
+
+class Snapshot:
+    """Columns of the dataset (read-only numpy arrays) and their metadata"""
+
+    def __init__(
+            self,
+            columns: Dict[str, np.ndarray],
+            categories: List[str],
+            continents: List[str],
+        ) -> None:
+        self.columns: Dict[str, np.ndarray] = columns
+        # Names of the boolean columns tagging the country categories
+        self.categories: List[str] = categories
+        # Names of the continents, each has a boolean column "continent_{name}"
+        self.continents: List[str] = continents
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values())))
+
+
+def source_digest(csv_path: str) -> str:
+    """Hash of the sources of the snapshot: the CSV and the categories"""
+    h = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        h.update(f.read())
+    h.update(json.dumps(CATEGORIES, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+def save_snapshot(
+        folder: str,
+        columns: Dict[str, np.ndarray],
+        categories: List[str],
+        continents: List[str],
+        source_digest: str,
+    ) -> None:
+    """
+    Writes the snapshot. Each column must be a 1D numpy array of bool, float
+    or fixed-size unicode (missing strings are stored as empty strings).
+    """
+    os.makedirs(folder, exist_ok=True)
+    files: Dict[str, str] = {}
+    for i, (name, values) in enumerate(columns.items()):
+        if values.dtype.kind not in "bfU":
+            raise TypeError(f"Column {name} has an unsupported dtype: {values.dtype}")
+        files[name] = f"col_{i}.npy"
+        np.save(os.path.join(folder, files[name]), values, allow_pickle=False)
+    meta: Dict[str, Any] = {
+        "version": SNAPSHOT_VERSION,
+        "source_digest": source_digest,
+        "n_rows": len(next(iter(columns.values()))),
+        "files": files,
+        "categories": categories,
+        "continents": continents,
+    }
+    # The header is written last (and atomically): a snapshot without
+    # an up to date header is never loaded
+    tmp_path: str = os.path.join(folder, META_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(folder, META_FILE))
+
+
+def load_snapshot(folder: str, source_digest: Optional[str] = None) -> Optional[Snapshot]:
+    """
+    Memory-maps the snapshot. Returns None if there is no snapshot, if it was
+    written with another version of the format, or if it was built from
+    another source (when `source_digest` is given).
+    """
+    meta_path: str = os.path.join(folder, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta: Dict[str, Any] = json.load(f)
+    if meta.get("version") != SNAPSHOT_VERSION:
+        return None
+    if source_digest is not None and meta["source_digest"] != source_digest:
+        return None
+    columns: Dict[str, np.ndarray] = {
+        name: np.load(os.path.join(folder, file_name), mmap_mode="r", allow_pickle=False)
+        for name, file_name in meta["files"].items()
+    }
+    return Snapshot(columns, meta["categories"], meta["continents"])
+
+
+def load_or_build_snapshot(csv_path: str = CSV_PATH, folder: str = SNAPSHOT_FOLDER) -> Snapshot:
+    """Loads the snapshot of the CSV, (re)building it first if it is missing or outdated"""
+    digest: str = source_digest(csv_path)
+    snapshot: Optional[Snapshot] = load_snapshot(folder, digest)
+    if snapshot is None:
+        from data import SnapshotBuilder  # Only needed to build: pandas is not imported otherwise
+        SnapshotBuilder.build(csv_path, folder)
+        snapshot = load_snapshot(folder, digest)
+    return snapshot
+
+
+if __name__ == "__main__":
+    from data import SnapshotBuilder
+    SnapshotBuilder.build(CSV_PATH, SNAPSHOT_FOLDER)
@@ -5,15 +5,22 @@ TODO: Button to remove already passed countries in the dropdown options (to togg
 TODO: fix NaN in dataframe
 """
 import os
+import uuid
 import random
-import base64
+import functools
 
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
 from dash.exceptions import PreventUpdate
-import pandas as pd
-from typing import List, Dict, Any, Tuple, Optional, Literal, Set
+import numpy as np
+from typing import List, Dict, Any, Tuple, Optional, Literal, Set, FrozenSet
+
+from image_cache import ImageCache, DEFAULT_MAX_BYTES
+from asset_optimizer import load_manifest, parse_manifest, MANIFEST_KEY
+from asset_bundle import AssetBundle, BUNDLE_PATH
+from snapshot import Snapshot, load_or_build_snapshot, CSV_PATH, SNAPSHOT_FOLDER
+from answer_token import make_token, shuffle_seed, sign_status, verify_status, CLIENTSIDE_CHECK
 
 NAME_COL: str = "FINAL_GEOUNIT"
 STYLE_BUTTON_CENTER: Dict[str, str] = {
@@ -21,6 +28,58 @@ STYLE_BUTTON_CENTER: Dict[str, str] = {
     'justifyContent': 'center',
     'alignItems': 'center',
 }
+# Width of the country image on the page, used by the browser to pick an image variant:
+# half of its div, itself half of the 60vw panel
+IMAGE_SIZES: str = "15vw"
+# Width of the variant used when the browser does not support srcset
+IMAGE_DEFAULT_WIDTH: int = 512
+# Number of upcoming questions whose images are preloaded by the browser (0: none)
+PREFETCH_SIZE: int = int(os.environ.get("WORLDLE_PREFETCH_SIZE", 2))
+if PREFETCH_SIZE < 0:
+    raise ValueError(f"WORLDLE_PREFETCH_SIZE must be >= 0, got {PREFETCH_SIZE}")
+
+def mask_to_bits(mask: np.ndarray) -> int:
+    """Converts a boolean mask to an integer bitset (bit i <=> mask[i])"""
+    return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+
+def hex_to_bits(value: Any, n: int) -> int:
+    """Bitset of `n` bits from its hexadecimal representation, ValueError if it is not one"""
+    if not isinstance(value, str) or not 0 < len(value) <= max(1, (n + 3) // 4):
+        raise ValueError(f"Invalid bitset: {value!r}")
+    bits: int = int(value, 16)
+    if bits < 0:
+        raise ValueError(f"Invalid bitset: {value!r}")
+    return bits & ((1 << n) - 1)
+
+
+def int_in_range(value: Any, low: int, high: int) -> int:
+    """Integer of [low, high), ValueError if it is not one"""
+    if type(value) is not int or not low <= value < high:
+        raise ValueError(f"Expected an integer in [{low}, {high}), got {value!r}")
+    return value
+
+
+def bits_to_ids(bits: int) -> List[int]:
+    """Indices of the bits set in a bitset, in increasing order"""
+    n_bytes: int = (bits.bit_length() + 7) // 8
+    packed: np.ndarray = np.frombuffer(bits.to_bytes(n_bytes, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed, bitorder="little")).tolist()
+
+
+@functools.lru_cache(maxsize=256)
+def shuffled_ids(seed: int, bits: int) -> Tuple[int, ...]:
+    """
+    Deterministic random permutation of the indices of a bitset. The order of the
+    questions of a game is fully described by (seed, eligible bits), hence the
+    sessions only store these, and the permutation is computed once per game.
+    The shuffle is seeded with a keyed hash of the seed: the browser holding the
+    seed cannot compute the next questions.
+    """
+    ids: List[int] = bits_to_ids(bits)
+    random.Random(shuffle_seed(seed)).shuffle(ids)
+    return tuple(ids)
+
 
 class CONST:
     class ID:
@@ -39,21 +98,19 @@ class CONST:
         RADIOITEMS_QUIZ_TARGET: str = "ri-quiz-target"
         DIV_IMAGE: str = "image-hint-holder"
         DIV_TEXT: str = "text-hint-holder"
+        STORE_STATUS: str = "store-status"
+        DIV_PREFETCH: str = "prefetch-holder"
+        STORE_ROUND: str = "store-round"
+        STORE_GUESS: str = "store-guess"
 
     class COL:
         CAPITAL: str = "capital"
         CONTINENT: str = "continent"
         NAME: str = "name"
-        # Which row is included in the current challenge
-        CHALL_ELIGIBLE: str = "CHALL_ELIGIBLE"
-        # Which row was already guessed in the quizz
-        CHALL_DONE: str = "CHALL_DONE"
-        # Which row was correctly guessed in the quizz
-        CHALL_CORRECT: str = "CHALL_CORRECT"
-        # Bytes data of the image of the country's outline
-        OUTLINE_IMAGE_DATA: str = "OUTLINE_IMAGE_DATA"
-        # Bytes data of the image of the country's outline
-        FLAG_IMAGE_DATA: str = "FLAG_IMAGE_DATA"
+        # Path of the image of the country's outline (relative to the image folder)
+        OUTLINE_IMAGE_PATH: str = "OUTLINE_IMAGE_PATH"
+        # Path of the image of the country's flag (relative to the image folder)
+        FLAG_IMAGE_PATH: str = "FLAG_IMAGE_PATH"
         # UNUSEABLE OUTLINE
         OUTLINE_UNUSEABLE: str = "outline_unuseable"
         # FINAL GEOUNIT (name column from outlines dataframe)
@@ -63,17 +120,25 @@ class CONST:
 class Status:
     """
     Represents the status of the UI, holds the variable that describe the Dash app.
-    Could be a simple datastructure
+    There is one status per session (browser tab), see `to_dict` / `from_dict`.
     """
+    # Fields of `to_dict`, in the order in which they are signed
+    FIELDS: Tuple[str, ...] = (
+        "sid", "explore", "challenge", "input", "target",
+        "eligible", "correct", "seed", "n_questions", "n_correct", "n_total",
+    )
+
     def __init__(
             self,
         ) -> None:
+        # Identifier of the session
+        self.sid: str = uuid.uuid4().hex
+
         # Input / Question parameters
         self.current_guess_idx: int = 0
         self.current_explore_idx: int = 0
 
         # Dropdown text output
-        self.dropdown_value_idx: int = None
         self.dropdown_options: List[Dict[str, str]] = []
 
         # Mode
@@ -104,14 +169,89 @@ class Status:
         self._theoric_total: int = 0
 
         # Hint given
-        self.image_data: str = ""
+        self.image_src: str = ""
+        self.image_srcset: Optional[str] = None
         self.show_image: bool = True
         self.text_to_guess: str = ""
         self.show_text: bool = False
         # Answer
         self.answer: str = ""
         self.answer_style: Dict[str, str] = {}
-        
+
+        # Bitset of the countries included in the current challenge
+        self.eligible: int = 0
+        # Bitset of the countries correctly guessed in the quizz
+        self.correct: int = 0
+        # The questions are the eligible countries in the order of a shuffle seeded
+        # by `seed`: the countries already guessed are the first `_n_questions` ones
+        self.seed: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Compact representation of the status, stored in the browser (dcc.Store)
+        and sent back with the callbacks. Only what cannot be recomputed is kept:
+        the country to guess is not, it would give away the answer.
+        The counters are only read by the browser (see CHECK_ANSWER_JS).
+        It is signed: the browser cannot edit it (see answer_token.py).
+        """
+        d: Dict[str, Any] = {
+            "sid": self.sid,
+            "explore": self.current_explore_idx,
+            "challenge": self.is_mode_challenge,
+            "input": self.quizz_input,
+            "target": self.quizz_target,
+            "eligible": format(self.eligible, "x"),
+            "correct": format(self.correct, "x"),
+            "seed": self.seed,
+            "n_questions": self._n_questions,
+            "n_correct": self._n_correct,
+            "n_total": self._n_total,
+        }
+        d["sig"] = sign_status(__class__.signed_values(d))
+        return d
+
+    @staticmethod
+    def signed_values(d: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(d.get(k) for k in __class__.FIELDS)
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any], table: "CountryTable") -> "Status":
+        """
+        Rebuilds the status of a session from `to_dict`. It comes from the browser:
+        its signature and its values are checked (ValueError if it is not valid),
+        and what can be recomputed from the bitsets is not read.
+        """
+        if not isinstance(d, dict) or not verify_status(__class__.signed_values(d), d.get("sig")):
+            raise ValueError("Status not signed by the server")
+        s: Status = Status()
+        try:
+            if not isinstance(d["sid"], str) or len(d["sid"]) > 64:
+                raise ValueError(f"Invalid session id: {d['sid']!r}")
+            s.sid = d["sid"]
+            if not isinstance(d["challenge"], bool):
+                raise ValueError(f"Invalid mode: {d['challenge']!r}")
+            s.is_mode_challenge = d["challenge"]
+            if d["input"] not in s.quizz_input_options or d["target"] not in s.quizz_target_options:
+                raise ValueError(f"Invalid quizz: {d['input']!r} => {d['target']!r}")
+            s.quizz_input = d["input"]
+            s.quizz_target = d["target"]
+            s.show_image = (s.quizz_input in ["Flag", "Outline"])
+            s.show_text = not s.show_image
+            s.current_explore_idx = int_in_range(d["explore"], 0, table.n)
+            s.eligible = hex_to_bits(d["eligible"], table.n)
+            if s.eligible & ~(table.mode_bits[s.quizz_input] & table.mode_bits[s.quizz_target]):
+                raise ValueError("Countries without the data of the quizz")
+            s.correct = hex_to_bits(d["correct"], table.n) & s.eligible
+            s.seed = int_in_range(d["seed"], 0, 1 << 32)
+            s._n_total = s.eligible.bit_count()
+            s._n_correct = s.correct.bit_count()
+            s._n_questions = int_in_range(d["n_questions"], 0, s._n_total + 1)
+        except KeyError as e:
+            raise ValueError(f"Missing field in the status: {e}") from None
+        if s._n_questions > 0:  # The question being asked
+            s.current_guess_idx = shuffled_ids(s.seed, s.eligible)[s._n_questions - 1]
+        return s
+
     @property
     def score_text(self) -> str:
         """Outputs the score"""
@@ -166,80 +306,194 @@ class Status:
     def continent_checklist_value(self) -> str:
         return [cat for cat, b in self.continents.items() if b]
 
+class CountryTable:
+    """
+    Immutable table of the countries of the game, built from the snapshot.
+    Countries are identified by their row number. Values read one at a time
+    are kept in lists, and the masks used to select the countries of a quizz
+    are precomputed as integer bitsets (bit i <=> country i).
+    """
+    __slots__ = (
+        "n", "names", "capitals", "outline_keys", "flag_keys",
+        "all_bits", "mode_bits", "category_bits", "continent_bits",
+    )
+
+    def __init__(self, snapshot: Snapshot) -> None:
+        columns: Dict[str, np.ndarray] = snapshot.columns
+        self.n: int = len(snapshot)
+        # Missing strings are stored as empty strings in the snapshot
+        self.names: List[Optional[str]] = [v or None for v in columns[CONST.COL.NAME].tolist()]
+        self.capitals: List[Optional[str]] = [v or None for v in columns[CONST.COL.CAPITAL].tolist()]
+        # Paths of the images, relative to the image folder
+        self.outline_keys: List[Optional[str]] = [
+            v or None for v in columns[CONST.COL.OUTLINE_IMAGE_PATH].tolist()]
+        self.flag_keys: List[Optional[str]] = [
+            v or None for v in columns[CONST.COL.FLAG_IMAGE_PATH].tolist()]
+
+        self.all_bits: int = (1 << self.n) - 1
+        # Quiz input / target => countries that have the data to be used in this mode
+        has_outline: int = mask_to_bits(columns[CONST.COL.OUTLINE_IMAGE_PATH] != "")
+        self.mode_bits: Dict[str, int] = {
+            "Capital": mask_to_bits(columns[CONST.COL.CAPITAL] != ""),
+            "Name": mask_to_bits(columns[CONST.COL.NAME] != ""),
+            "Outline": has_outline,
+            "Flag": has_outline,
+        }
+        # Category => countries in the category
+        self.category_bits: Dict[str, int] = {
+            cat: mask_to_bits(columns[cat]) for cat in snapshot.categories}
+        # Continent => countries in the continent
+        self.continent_bits: Dict[str, int] = {
+            continent: mask_to_bits(columns[f"continent_{continent}"])
+            for continent in snapshot.continents
+        }
+
+    def labels(self, target: Literal["Capital", "Name"]) -> List[Optional[str]]:
+        """Values of the column that is the answer of the quizz"""
+        if target == "Capital":
+            return self.capitals
+        elif target == "Name":
+            return self.names
+        raise NotImplementedError
+
+    @functools.lru_cache(maxsize=64)
+    def dropdown_options(self, target: str, bits: int) -> List[Dict[str, Any]]:
+        """
+        Options of the answer dropdown for the countries of a bitset. The lists
+        are cached and shared between the sessions: they must not be modified.
+        """
+        if target not in ["Capital", "Name"]:
+            raise NotImplementedError
+        labels: List[Optional[str]] = self.labels(target)
+        return [{"label": labels[idx], "value": idx} for idx in bits_to_ids(bits)]
+
+    @functools.lru_cache(maxsize=4096)
+    def eligible(
+            self,
+            quiz_input: str,
+            quiz_target: str,
+            categories: FrozenSet[str],
+            continents: FrozenSet[str],
+        ) -> Tuple[int, int]:
+        """
+        Bitset & number of the countries eligible for a quizz, given its
+        input, its target, and the selected categories & continents.
+        The result is memoized: there are few possible settings.
+        """
+        bits: int = self.mode_bits[quiz_input] & self.mode_bits[quiz_target]
+        # Checking for categories
+        for cat, cat_bits in self.category_bits.items():
+            if cat not in categories:
+                bits &= ~cat_bits
+        # Then we check for the continents: everything is false until we find a continent
+        cont_bits: int = 0
+        for continent, continent_bits in self.continent_bits.items():
+            # Some countries can be on multiple continents (Russia).
+            # Hence we add a country if he belongs to at least 1 selected continent
+            if continent in continents:
+                cont_bits |= continent_bits
+        bits &= cont_bits
+        return bits, bits.bit_count()
+
+
+class GameData:
+    """
+    Data shared by all the sessions: the country table and the images.
+    It is read-only once loaded (the image cache is thread-safe).
+    """
+
+    def __init__(self, image_cache_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        # Images are read from the asset bundle if it was built, else they
+        # are loaded lazily from their folder, when they are first shown
+        self.images: ImageCache = ImageCache(
+            folder="files",
+            max_bytes=image_cache_bytes,
+            bundle=AssetBundle.open_if_exists(BUNDLE_PATH),
+        )
+        # The dataset is precompiled (see snapshot.py), and rebuilt only if the CSV changed
+        snapshot: Snapshot = load_or_build_snapshot(CSV_PATH, SNAPSHOT_FOLDER)
+        self.table: CountryTable = CountryTable(snapshot)
+        self.categories: List[str] = snapshot.categories
+        self.continents: List[str] = snapshot.continents
+        # The images themselves are read on demand
+        self.images.register(k for k in self.table.outline_keys + self.table.flag_keys if k)
+        self.variants: Dict[str, List[Dict[str, Any]]] = self.load_variants()
+
+    def load_variants(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Loads the resized variants of the images (see asset_optimizer.py).
+        If they were not generated, the original images are used.
+        """
+        bundle: Optional[AssetBundle] = self.images.bundle
+        if bundle is not None and MANIFEST_KEY in bundle:
+            manifest: Optional[Dict[str, Any]] = parse_manifest(bundle.get(MANIFEST_KEY))
+        else:
+            manifest: Optional[Dict[str, Any]] = load_manifest(os.path.join("files", MANIFEST_KEY))
+        if manifest is None:
+            return {}
+        variants: Dict[str, List[Dict[str, Any]]] = {}
+        for key, entry in manifest["images"].items():
+            if key not in self.images:  # Image not used in the game
+                continue
+            variants[key] = entry["variants"]
+            self.images.register(
+                [v["key"] for v in entry["variants"]],
+                digests={v["key"]: v["digest"] for v in entry["variants"]},
+            )
+        return variants
+
+
 class UI:
+    """
+    Game logic of 1 session: combines the shared data with the status of the session.
+    It is cheap to build, a new one is built for each callback.
+    """
 
-    def __init__(self) -> None:
-        self.df: pd.DataFrame = self.load_dataframe()
-        categories, continents = self.tag_data_with_info()
+    def __init__(self, data: GameData, s: Optional[Status] = None) -> None:
+        self.data: GameData = data
+        self.table: CountryTable = data.table
+        self.images: ImageCache = data.images
+        self.variants: Dict[str, List[Dict[str, Any]]] = data.variants
+        self.n: int = self.table.n
+        if s is not None:  # Existing session
+            self.s: Status = s
+            return
+        # New session
         self.s: Status = Status()
-
-        self.s.categories = categories
-        self.s.continents = continents
-        self.reset_dataframe()
-        self.n: int = len(self.df)
+        self.s.categories = {cat: True for cat in data.categories}
+        self.s.continents = {continent: True for continent in data.continents}
+        self.reset_game()
 
         self.update_dropdown_options()
         self.sample_new_question()
+        self.update_visuals()
 
-    def load_dataframe(self) -> pd.DataFrame:
-        """Loads and process the merged dataframe"""
-        df: pd.DataFrame = pd.read_csv("files/merged_df.csv", sep=";")
-        df.sort_values(by=[NAME_COL], ascending=True, inplace=True)
-        df.reset_index(inplace=True, drop=True)
-        # Now we prepare the image data
-        image_folder: str = os.path.join("files", "outlines")
-        m: pd.Series = df["outline_file_name"].notna()
-        for idx, file_name in df.loc[m, "outline_file_name"].items():
-            image_path: str = os.path.join(image_folder, file_name)
-            df.loc[idx, CONST.COL.OUTLINE_IMAGE_DATA] = __class__.encode_image(image_path)
-        df.loc[df[CONST.COL.OUTLINE_UNUSEABLE], CONST.COL.OUTLINE_IMAGE_DATA] = None
-        # Same with flag images
-        image_folder: str = os.path.join("files", "flags")
-        m: pd.Series = df["flag_file_name"].notna()
-        for idx, file_name in df.loc[m, "flag_file_name"].items():
-            image_path: str = os.path.join(image_folder, file_name)
-            df.loc[idx, CONST.COL.FLAG_IMAGE_DATA] = __class__.encode_image(image_path)
-
-        m: pd.Series = df[CONST.COL.NAME].isna()
-        df.loc[m, CONST.COL.NAME] = df.loc[m, CONST.COL.FINAL_GEOUNIT]
-        return df
+    def apply_settings(
+            self,
+            checklist_cat: List[str],
+            checklist_continent: List[str],
+            quiz_input: str,
+            quiz_target: str,
+        ) -> None:
+        """Sets the settings chosen in the left panel, used at the next reset"""
+        self.s.categories = {cat: cat in checklist_cat for cat in self.data.categories}
+        self.s.continents = {cont: cont in checklist_continent for cont in self.data.continents}
+        self.s.quizz_input_value = quiz_input
+        self.s.quizz_target_value = quiz_target
 
     def update_dropdown_options(self) -> None:
         """Builds the answer dropdown options"""
-        if self.s.quizz_target == "Capital":
-            m: pd.Series = self.df[CONST.COL.CHALL_ELIGIBLE]
-            options: List[Dict[str, str]] = [
-                {"label": name, "value": idx}
-                for idx, name in self.df.loc[m, CONST.COL.CAPITAL].items()
-            ]
-        elif self.s.quizz_target == "Flag":
-            raise NotImplementedError
-        elif self.s.quizz_target == "Name":
-            m: pd.Series = self.df[CONST.COL.CHALL_ELIGIBLE]
-            options: List[Dict[str, str]] = [
-                {"label": name, "value": idx}
-                for idx, name in self.df.loc[m, CONST.COL.NAME].items()
-            ]
-        elif self.s.quizz_target == "Outline":
-            raise NotImplementedError
-        else:
-            raise NotImplementedError
-        self.s.dropdown_options = options
+        self.s.dropdown_options = self.table.dropdown_options(self.s.quizz_target, self.s.eligible)
 
     def sample_new_question(self) -> None:
         """
         Sample a random country amongst the ones not sampled so far, 
         so it can be guessed
         """
-        # Counting the number of countries that are eligible but not done yet
-        m: pd.Series = (~self.df[CONST.COL.CHALL_DONE] &
-                            self.df[CONST.COL.CHALL_ELIGIBLE])
-        n_remaining: int = m.sum()
-        # We roll a random number for a random new country
-        idx: int = random.randint(0, n_remaining - 1)
-        self.s.current_guess_idx = self.df[m].index[idx]
+        # The next country in the shuffled order of the game
+        self.s.current_guess_idx = shuffled_ids(self.s.seed, self.s.eligible)[self.s._n_questions]
         # We flag that new country as now done
-        self.df.loc[self.s.current_guess_idx, CONST.COL.CHALL_DONE] = True
+        self.s._n_questions += 1
 
     def update_visuals(self) -> None:
         """
@@ -249,121 +503,86 @@ class UI:
             idx: int = self.s.current_guess_idx
         else:  # Exploration index
             idx: int = self.s.current_explore_idx
-        if self.s.quizz_input == "Outline":
-            self.s.image_data = self.df.loc[idx, CONST.COL.OUTLINE_IMAGE_DATA]
-        elif self.s.quizz_input == "Flag":
-            self.s.image_data = self.df.loc[idx, CONST.COL.FLAG_IMAGE_DATA]
+        if self.s.quizz_input in ["Outline", "Flag"]:
+            self.s.image_src = self.get_image_url(idx, self.s.quizz_input)
+            self.s.image_srcset = self.get_image_srcset(idx, self.s.quizz_input)
         elif self.s.quizz_input == "Capital":
-            self.s.text_to_guess = self.df.loc[idx, CONST.COL.CAPITAL]
+            self.s.text_to_guess = self.table.capitals[idx]
         elif self.s.quizz_input == "Name":
-            self.s.text_to_guess = self.df.loc[idx, CONST.COL.NAME]
+            self.s.text_to_guess = self.table.names[idx]
         else:
             raise NotImplementedError
 
 
-    def reset_dataframe(self) -> None:
+    def reset_game(self) -> None:
         """
-        Resets the dataframe to starting parameters. Score is reset
+        Resets the game to starting parameters. Score is reset
         and you can guess all the countries again
         """
-        self.df.loc[:, CONST.COL.CHALL_DONE] = False
-        self.df.loc[:, CONST.COL.CHALL_CORRECT] = False
-        self.df.loc[:, CONST.COL.CHALL_ELIGIBLE] = self._compute_mask_eligible()
+        self.s.eligible, self.s._n_total = self._compute_mask_eligible()
+        self.s.correct = 0
+        self.s.seed = random.getrandbits(32)
+        self.s._n_questions = 0
+        self.s._n_correct = 0
 
         self.s.quizz_input = self.s.quizz_input_value
         self.s.quizz_target = self.s.quizz_target_value
         self.s.show_image = (self.s.quizz_input in ["Flag", "Outline"])
         self.s.show_text = not self.s.show_image
             
-    def _compute_mask_eligible(self) -> pd.Series:
+    def _compute_mask_eligible(self) -> Tuple[int, int]:
         """
-        Computes the mask of the rows that are eligible for the
-        quizz with the current parameters
+        Computes the bitset & number of the rows that are eligible
+        for the quizz with the current parameters
         """
-        m: pd.Series = pd.Series({idx: True for idx in self.df.index})
-        if (self.s.quizz_input_value == "Capital") or (self.s.quizz_target_value == "Capital"):
-            m &= self.df[CONST.COL.CAPITAL].notna()
-        if (self.s.quizz_input_value == "Name") or (self.s.quizz_target_value == "Name"):
-            m &= self.df[CONST.COL.NAME].notna()
-        if (self.s.quizz_input_value == "Outline") or (self.s.quizz_target_value == "Outline"):
-            m &= self.df[CONST.COL.OUTLINE_IMAGE_DATA].notna()
-        if (self.s.quizz_input_value == "Flag") or (self.s.quizz_target_value == "Flag"):
-            m &= self.df[CONST.COL.OUTLINE_IMAGE_DATA].notna()
-        # Checking for categories
-        for cat in [k for k,v in self.s.categories.items() if not v]:
-            m &= ~self.df[cat]
-        
-        # Then we check for the continents: everything is false until we find a continent
-        m_cont: pd.Series = pd.Series({idx: False for idx in self.df.index})
-        for continent in [k for k,v in self.s.continents.items() if v]:
-            # Some countries can be on multiple continents (Russia).
-            # Hence we add a country if he belongs to at least 1 selected continent
-            m_cont |= self.df[f"continent_{continent}"].fillna(False)
-        return m & m_cont
-    
-    def update_score(self) -> None:
-        """Computes new score"""
-        self.s._n_correct = self.df[CONST.COL.CHALL_CORRECT].sum()
-        self.s._n_questions = self.df[CONST.COL.CHALL_DONE].sum()
-        self.s._n_total = self.df[CONST.COL.CHALL_ELIGIBLE].sum()
-        # We remove 1 because one is currently being guessed
-    
+        return self.table.eligible(
+            self.s.quizz_input_value,
+            self.s.quizz_target_value,
+            frozenset(k for k, v in self.s.categories.items() if v),
+            frozenset(k for k, v in self.s.continents.items() if v),
+        )
+
+    def mark_correct(self, idx: int) -> None:
+        """Flags a country as correctly guessed"""
+        if not (self.s.correct >> idx) & 1:
+            self.s.correct |= 1 << idx
+            self.s._n_correct += 1
+
+    def first_eligible(self) -> int:
+        """Smallest index of the countries in the current challenge"""
+        return (self.s.eligible & -self.s.eligible).bit_length() - 1
+
+    def upcoming_ids(self) -> Tuple[int, ...]:
+        """
+        Queue of the next questions, in the shuffled order of the game:
+        `sample_new_question` pops its head.
+        """
+        start: int = self.s._n_questions
+        return shuffled_ids(self.s.seed, self.s.eligible)[start:start + PREFETCH_SIZE]
+
+    def prefetch_image(self, idx: int) -> html.Img:
+        """Hidden image of an upcoming question, downloaded ahead of time by the browser"""
+        return html.Img(
+            src=self.get_image_url(idx, self.s.quizz_input),
+            srcSet=self.get_image_srcset(idx, self.s.quizz_input),
+            sizes=IMAGE_SIZES,  # Same as the displayed image so the same variant is loaded
+        )
+
+    def prefetch_images(self) -> List[html.Img]:
+        if not self.s.show_image:
+            return []
+        return [self.prefetch_image(idx) for idx in self.upcoming_ids()]
+
+    def answer_token(self) -> Dict[str, Any]:
+        """Signed answer of the current question, for the clientside check of the answers"""
+        return make_token(self.s.sid, self.s.seed, self.s._n_questions, self.s.current_guess_idx)
+
     def update_theoric_total(self) -> None:
         """
         This functions compute the number of countries that would be 
         in the game with the new settings
         """
-        m = self._compute_mask_eligible()
-        self.s._theoric_total = m.sum()
-
-    def tag_data_with_info(self) -> Tuple[Dict[str, bool], Dict[str, bool]]:
-        d: Dict[str, List[str]] = {
-            "Small islands" : [
-                "Aland", "Cabo Verde", "Falkland Islands",
-                "Faroe Islands", "Isle of Man", "Kiribati", "Maldives", 
-                "Malta", "Jamaica", "New Caledonia", "Taiwan", 
-                "Puerto Rico", "Solomon Islands", "Svalbard", "The Bahamas", 
-            ],
-            "Very small islands": [
-                "Wallis and Futuna", "Vanuatu", "United States Virgin Islands", 
-                "Tuvalu", "Turks and Caicos Islands", "Trinidad and Tobago", "Tonga",
-                "Spratly Islands", "South Georgia and the Islands", "Seychelles",
-                "São Tomé and Principe", "Samoa", "Saint Vincent and the Grenadines",
-                "Saint Pierre and Miquelon", "Saint Lucia", "Saint Kitts and Nevis",
-                "Reunion", "Pitcairn Islands", "Paracel Islands", "Palau", 
-                "Northern Mariana Islands", "Norfolk Island", "Niue", "Montserrat",
-                "Mayotte", "Mauritius", "Martinique", "Marshall Islands","Madeira",
-                "Madeira", "Jersey", "Guernsey", "Guam", "Guadeloupe", "Grenada", 
-                "French Southern and Antarctic Lands", "French Polynesia", 
-                "Fiji", "Federated States of Micronesia", "Dominica", 
-                "Curaçao", "Cook Islands", "Comoros", "Christmas Islands",
-                "Cocos (Keeling) Islands", "Cayman Islands", "Carribean Netherlands",
-                "British Virgin Islands", "British Indian Ocean Territory", 
-                "Bermuda", "Barbados", "Azores", "Aruba", "Antigua and Barbuda",
-                "Anguilla", "American Samoa", 
-            ],
-            "Small Land Countries": [
-                "Bahrain", "Andorra", "Brunei",
-                "Djibouti", "East Timor",
-                "Hong Kong S.A.R.", "Macao S.A.R",
-                "Kuwait", "Qatar",
-                "Liechtenstein", "San Marino"
-                "Singapore", "Eswatini"
-            ],
-            "Ill-shaped": [
-                "Vatican", "Monaco", 
-            ]
-        }
-        for cat, elem_in_cat in d.items():
-            self.df[cat] = self.df["FINAL_GEOUNIT"].isin(elem_in_cat).fillna(False)
-
-        # Continents
-        self.df.fillna(value={CONST.COL.CONTINENT: "Undefined"}, inplace=True)
-        set_cont: Set[str] = self.df[CONST.COL.CONTINENT].dropna().apply(
-            lambda x: x.split(",")[0]).unique()
-        for continent in set_cont:
-            self.df[f"continent_{continent}"] = self.df[CONST.COL.CONTINENT].str.contains(continent)
-        return {k: True for k in d.keys()}, {continent: True for continent in set_cont}
+        _, self.s._theoric_total = self._compute_mask_eligible()
 
     def build_layout(self) -> html.Div:
         """Builds the app layout"""
@@ -457,7 +676,9 @@ class UI:
                     children=[
                         html.Img(
                             id=CONST.ID.IMAGE_COUNTRY, 
-                            src=self.s.image_data, 
+                            src=self.s.image_src, 
+                            srcSet=self.s.image_srcset,
+                            sizes=IMAGE_SIZES,
                             style={'width': '50%'}
                         ),
                     ]
@@ -502,7 +723,19 @@ class UI:
         ######################################################################
         ######################################################################
         return html.Div(
-            children=[left_panel, right_panel], 
+            children=[
+                left_panel,
+                right_panel,
+                # Status of the session, sent back to the server with the callbacks
+                dcc.Store(id=CONST.ID.STORE_STATUS, storage_type="memory", data=self.s.to_dict()),
+                # Images of the next questions, loaded but not displayed
+                html.Div(id=CONST.ID.DIV_PREFETCH, style={"display": "none"}, children=self.prefetch_images()),
+                # Answer of the current question & last guess, when answers are checked in the browser
+                *([
+                    dcc.Store(id=CONST.ID.STORE_ROUND, storage_type="memory", data=self.answer_token()),
+                    dcc.Store(id=CONST.ID.STORE_GUESS, storage_type="memory", data=None),
+                ] if CLIENTSIDE_CHECK else []),
+            ], 
             style={
                 "backgroundColor": "#000000",
                 "height": "100%",
@@ -512,7 +745,31 @@ class UI:
         )
 
 
-    @staticmethod
-    def encode_image(image_path: str) -> str:
-        encoded_image = base64.b64encode(open(image_path, 'rb').read()).decode('ascii')
-        return 'data:image/png;base64,{}'.format(encoded_image)
+    def get_image_key(self, idx: int, kind: Literal["Outline", "Flag"]) -> Optional[str]:
+        """Returns the path of the original image of a country"""
+        if kind == "Outline":
+            return self.table.outline_keys[idx]
+        elif kind == "Flag":
+            return self.table.flag_keys[idx]
+        raise NotImplementedError
+
+    def get_image_url(self, idx: int, kind: Literal["Outline", "Flag"]) -> Optional[str]:
+        """
+        Returns the URL of the image of a country: the variant closest to
+        IMAGE_DEFAULT_WIDTH if the variants exist, else the original image.
+        """
+        key: Optional[str] = self.get_image_key(idx, kind)
+        if key is None:
+            return None
+        variants: Optional[List[Dict[str, Any]]] = self.variants.get(key)
+        if variants:
+            key = min(variants, key=lambda v: abs(v["width"] - IMAGE_DEFAULT_WIDTH))["key"]
+        return self.images.url(key)
+
+    def get_image_srcset(self, idx: int, kind: Literal["Outline", "Flag"]) -> Optional[str]:
+        """Returns the srcset of the image of a country, None if there are no variants"""
+        key: Optional[str] = self.get_image_key(idx, kind)
+        variants: Optional[List[Dict[str, Any]]] = self.variants.get(key)
+        if not variants:
+            return None
+        return ", ".join(f"{self.images.url(v['key'])} {v['width']}w" for v in variants)
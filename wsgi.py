@@ -0,0 +1,15 @@
+"""
+Production entry point of the app, for a WSGI server:
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+Importing this module loads the data shared by all the sessions (country table,
+images, variants). With gunicorn's preload_app, this happens once in the master
+process: the workers are forked afterwards and share these pages copy-on-write.
+"""
+from main import app, serve_layout
+
+# Builds one layout so the caches of the default game (eligible countries, order
+# of the questions, dropdown options) are filled before the workers are forked
+serve_layout()
+
+server = app.server